@@ -1,59 +1,125 @@
 import json
 import os
+from array import array
 
-from typing import List, Set
+from typing import List, Set, Dict, Optional, Tuple, FrozenSet
+
+from piannot.fileio import atomic_write_text
 
 class AnnotationLoadingError(Exception):
     pass
 
 class Annotation:
-    objects: List[dict]
-    mising: Set[str]
-    
-    def __init__(self, objects = None, missing = None):
-        self.objects = list(objects) if objects is not None else list()
-        self.missing = set(missing) if missing is not None else set()
-        self._check_consistency()
-        
-    def add_object(self, cat: str, x: int, y: int, unique: bool=True):
-        if unique:
-            self.objects = [o for o in self.objects if not o["cat"] == cat ]
-        self.objects.append({"cat": cat, "x": x, "y": y})
-        self.missing.discard(cat)
-    
+    """Objects and missing categories of one image.
+
+    Objects are grouped by category: each category maps either to a flat
+    array `[x0, y0, x1, y1, ...]` of its object coordinates, or to `None` if
+    the category is missing. The json format is a list of objects
+    `{"cat": ..., "x": ..., "y": ...}` and a list of missing categories.
+
+    Categories whose objects were filled in by interpolation rather than by a
+    human are listed in `interpolated` (stored only when not empty).
+    """
+    __slots__ = ("_cats", "_interpolated")
+    _cats: Dict[str, Optional[array]]
+    _interpolated: Optional[Set[str]]
+
+    def __init__(self, objects = None, missing = None, interpolated = None):
+        self._cats = {}
+        self._interpolated = set(interpolated) if interpolated else None
+        for ob in objects or ():
+            self._cats.setdefault(ob["cat"], array("d")).extend((ob["x"], ob["y"]))
+        problem_cats = set(missing or ()).intersection(self._cats)
+        assert len(problem_cats) == 0, str(problem_cats)
+        for cat in missing or ():
+            self._cats[cat] = None
+
+    def add_object(self, cat: str, x: int, y: int, unique: bool=True, interpolated: bool=False):
+        coords = self._cats.get(cat)
+        if unique or coords is None:
+            self._cats[cat] = array("d", (x, y))
+        else:
+            coords.extend((x, y))
+        self._set_interpolated(cat, interpolated)
+
     def add_missing(self, cat):
-        self.objects = [o for o in self.objects if not o["cat"] == cat ]
-        self.missing.add(cat)
-        
+        self._cats[cat] = None
+        self._set_interpolated(cat, False)
+
+    def remove(self, cat: str):
+        """Make `cat` unspecified again."""
+        self._cats.pop(cat, None)
+        self._set_interpolated(cat, False)
+
+    def _set_interpolated(self, cat: str, interpolated: bool):
+        if interpolated:
+            if self._interpolated is None:
+                self._interpolated = set()
+            self._interpolated.add(cat)
+        elif self._interpolated:
+            self._interpolated.discard(cat)
+
+    def is_interpolated(self, cat: str) -> bool:
+        return bool(self._interpolated) and cat in self._interpolated
+
     def _is_empty(self):
-        return len(self.objects) == len(self.missing) == 0
+        return len(self._cats) == 0
 
-    
-    def to_json(self, path: str = None):
-        self._check_consistency()
+    @property
+    def objects(self) -> List[dict]:
+        """Objects as dicts. Modifying them does not change the annotation."""
+        return [
+            {"cat": cat, "x": coords[i], "y": coords[i + 1]}
+            for cat, coords in self._cats.items() if coords is not None
+            for i in range(0, len(coords), 2)
+        ]
+
+    @property
+    def missing(self) -> FrozenSet[str]:
+        return frozenset(cat for cat, coords in self._cats.items() if coords is None)
+
+    @property
+    def n_objects(self) -> int:
+        return sum(len(coords) // 2 for coords in self._cats.values() if coords is not None)
+
+    def get_points(self, cat: str) -> List[Tuple[float, float]]:
+        """Coordinates of objects of category `cat`."""
+        coords = self._cats.get(cat)
+        if coords is None:
+            return []
+        return list(zip(coords[::2], coords[1::2]))
+
+    def is_missing(self, cat: str) -> bool:
+        return cat in self._cats and self._cats[cat] is None
+
+    def annotated_cats(self) -> Set[str]:
+        """Categories with at least one object."""
+        return {cat for cat, coords in self._cats.items() if coords is not None}
+
+    def to_dict(self) -> dict:
         dic = {
             "objects": self.objects,
-            "missing": list(self.missing)
+            "missing": [cat for cat, coords in self._cats.items() if coords is None]
         }
-        
+        if self._interpolated:
+            dic["interpolated"] = sorted(self._interpolated)
+        return dic
+
+    def to_json(self, path: str = None):
+        dic = self.to_dict()
+
         if path is None:
             return json.dumps(dic)
         else:
             if not self._is_empty():
-                with open(path, "wt") as file:
-                    json.dump(dic, file)
-                    
+                atomic_write_text(path, json.dumps(dic))
+
     def __repr__(self):
         return self.to_json()
-    
+
     def __str__(self):
         return self.to_json()
-    
-    def _check_consistency(self):
-        object_cats = set(ob["cat"] for ob in self.objects)
-        problem_cats = self.missing.intersection(object_cats)
-        assert len(problem_cats) == 0, str(problem_cats)
-    
+
     @staticmethod
     def load(path: str):
         if not os.path.exists(path):
@@ -66,14 +132,15 @@ class Annotation:
             except Exception as exc:
                 msg = (f"Error loading annotation from {path}.")
                 raise AnnotationLoadingError(msg) from exc
-        
+
     def get_cat_state_description(self, cat:str):
-        if cat in self.missing:
+        if self.is_missing(cat):
             return "MISSING"
-        
-        obs = [ob for ob in self.objects if ob["cat"] == cat]
-        if len(obs) == 0:
+
+        points = self.get_points(cat)
+        if len(points) == 0:
             return "UNSPECIFIED"
-        
-        return [(int(round(ob["x"])), int(round(ob["y"]))) for ob in obs]
-    
+
+        rounded = [(int(round(x)), int(round(y))) for x, y in points]
+        return f"INTERPOLATED {rounded}" if self.is_interpolated(cat) else rounded
+
@@ -1,7 +1,61 @@
 import os
+import json
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from os.path import splitext
-from annotation import Annotation
-from typing import List
+from collections import defaultdict
+from piannot.annotation import Annotation, AnnotationLoadingError
+from typing import List, Dict, Callable, Sequence, Iterable, Tuple, Optional
+
+import numpy as np
+
+from piannot.fileio import atomic_write_text
+from piannot.write_behind import WriteBehindQueue
+
+import logging
+logger = logging.getLogger()
+
+# Per-category status of an annotation.
+UNSPECIFIED = 0
+ANNOTATED = 1
+MISSING = 2
+
+# Without the .json extension, so that it is not taken for an annotation.
+SNAPSHOT_NAME = ".annotations_snapshot"
+
+
+def _read_annotation_dict(path: str) -> dict:
+    try:
+        with open(path, "rt") as file:
+            return json.load(file)
+    except Exception as exc:
+        msg = (f"Error loading annotation from {path}.")
+        raise AnnotationLoadingError(msg) from exc
+
+
+def _read_snapshot(path: str) -> Dict[str, tuple]:
+    """Snapshot maps json file names to `(mtime_ns, size, annotation_dict)`.
+
+    It is stored as json, loading it must not run any code even if the shared folder is writable by others.
+    """
+    try:
+        with open(path, "rt") as file:
+            entries = json.load(file)
+        return {name: (int(mtime_ns), int(size), dict(dic)) for name, (mtime_ns, size, dic) in entries.items()}
+    except FileNotFoundError:
+        return {}
+    except Exception:
+        logger.exception("Ignoring unreadable snapshot %s.", path)
+        return {}
+
+
+def _write_snapshot(path: str, snapshot: Dict[str, tuple]):
+    try:
+        atomic_write_text(path, json.dumps(snapshot, separators=(",", ":")))
+    except OSError:
+        logger.exception("Writing snapshot %s failed.", path)
+
 
 class SimpleAnnotationDatabase:
     """This simpler class works but it is slow when reading all annotations."""
@@ -23,37 +77,222 @@ class SimpleAnnotationDatabase:
         annotation.to_json(path = self._get_annotation_path(key))
 
 class AnnotationDatabase:
+    """All annotations of one frame folder, kept in memory and stored as one json file per frame.
+
+    Subclasses may store the annotations differently by overriding
+    `_preload_annotations` and `_write_annotations`.
+
+    With `write_behind` the annotations are written on a background thread and
+    repeated saves of the same key are coalesced; `flush` or `close` waits for
+    the writes. Failed writes are retried and reported by `WriteError` raised
+    from a later save, `flush` or `close`. Files are always replaced atomically,
+    with `fsync` they are also flushed to the disk.
+
+    With `read_only` nothing is written to `annotation_dir`, neither the
+    folder itself nor the snapshot, and saving raises `RuntimeError`.
+    """
     _annotation_dir: str
-    _annotations: List[Annotation]
+    _annotations: Dict[str, Annotation]
+    _status: Dict[str, Dict[str, int]]
+    _listeners: List[Callable[[str], None]]
+    _writer: Optional[WriteBehindQueue]
+    read_only: bool = False
     
-    def __init__(self, annotation_dir: str):
-        os.makedirs(annotation_dir, exist_ok=True)
+    def __init__(self, annotation_dir: str, write_behind: bool = False, fsync: bool = False,
+                 read_only: bool = False):
+        if not read_only:
+            os.makedirs(annotation_dir, exist_ok=True)
+        self.read_only = read_only
         self._annotation_dir = annotation_dir
+        self._setup(write_behind=write_behind, fsync=fsync)
+    
+    def _setup(self, write_behind: bool, fsync: bool):
+        self.fsync = fsync
+        self._listeners = []
+        self._writer = WriteBehindQueue(self._write_annotations) if write_behind else None
+        self._snapshot_thread = None
         self._preload_annotations()
+        self._build_status_index()
         
     def _preload_annotations(self):
+        """Load all annotations, parsing only the files changed since the last snapshot."""
         annotation_dir = self._annotation_dir
-        jsons = [
-                f for f in os.listdir(annotation_dir) 
-                if splitext(f)[1] == ".json"
-        ]
+        with os.scandir(annotation_dir) as entries:
+            stats = {
+                e.name: (e.stat().st_mtime_ns, e.stat().st_size) 
+                for e in entries if splitext(e.name)[1] == ".json"
+            }
+        
+        snapshot = _read_snapshot(self._snapshot_path)
+        dics = {
+            name: snapshot[name][2] for name, stat in stats.items()
+            if name in snapshot and snapshot[name][:2] == stat
+        }
+        stale = [name for name in stats if name not in dics]
+        paths = [os.path.join(annotation_dir, name) for name in stale]
+        if len(stale) > 64:
+            with ThreadPoolExecutor() as executor:
+                dics.update(zip(stale, executor.map(_read_annotation_dict, paths)))
+        else:
+            dics.update(zip(stale, map(_read_annotation_dict, paths)))
+        logger.debug("Preloaded %d annotations, %d of them parsed.", len(dics), len(stale))
+        
         self._annotations = {
-            splitext(f)[0]: Annotation.load(os.path.join(annotation_dir, f)) 
-            for f in jsons
+            splitext(name)[0]: Annotation(**dic) for name, dic in dics.items()
         }
         
+        if not self.read_only and (stale or len(snapshot) != len(stats)):
+            new_snapshot = {name: stat + (dics[name],) for name, stat in stats.items()}
+            self._snapshot_thread = threading.Thread(
+                target=_write_snapshot, args=(self._snapshot_path, new_snapshot), daemon=True
+            )
+            self._snapshot_thread.start()
+    
+    @property
+    def _snapshot_path(self) -> str:
+        return os.path.join(self._annotation_dir, SNAPSHOT_NAME)
+        
     def _get_annotation_path(self, key: str) -> str:
         return os.path.join(
             self._annotation_dir, 
             splitext(key)[0] + ".json"
         )
     
+    def _write_annotations(self, items: List[Tuple[str, str]]):
+        """Write `(key, json_text)` pairs."""
+        for key, text in items:
+            atomic_write_text(self._get_annotation_path(key), text, fsync=self.fsync)
+    
+    def _build_status_index(self):
+        self._status = defaultdict(dict)
+        for key, annotation in self._annotations.items():
+            self._index_status(key, annotation)
+    
+    def _index_status(self, key: str, annotation: Annotation) -> bool:
+        """Update status index of `key`. Returns whether any status has changed."""
+        old = {cat: statuses.pop(key) for cat, statuses in self._status.items() if key in statuses}
+        new = {cat: ANNOTATED for cat in annotation.annotated_cats()}
+        new.update({cat: MISSING for cat in annotation.missing})
+        for cat, status in new.items():
+            self._status[cat][key] = status
+        return old != new
+    
 ####### Public Methods ########
     
     def load_annotation(self, key: str) -> Annotation:
         return self._annotations.get(key, Annotation())
         
     def save_annotation(self, annotation: Annotation, key: str):
-        self._annotations[key] = annotation
-        annotation.to_json(path = self._get_annotation_path(key))
-        
\ No newline at end of file
+        self.save_annotations([(key, annotation)])
+    
+    def save_annotations(self, items: Iterable[Tuple[str, Annotation]]):
+        """Save many `(key, annotation)` pairs at once."""
+        if self.read_only:
+            raise RuntimeError(f"Annotations in {self._annotation_dir} are opened read-only.")
+        items = list(items)
+        # Empty annotations are written only to overwrite stored ones.
+        stored = {key for key, _ in items if key in self._annotations}
+        for key, annotation in items:
+            self._annotations[key] = annotation
+        
+        # Serialize now, the annotation objects may change before they are written.
+        texts = [
+            (key, annotation.to_json()) for key, annotation in items 
+            if not annotation._is_empty() or key in stored
+        ]
+        for key, annotation in items:
+            if self._index_status(key, annotation):
+                for listener in self._listeners:
+                    listener(key)
+        
+        # Write last, so that a failed write leaves the in-memory state consistent.
+        if self._writer is None:
+            self._write_annotations(texts)
+        else:
+            self._writer.put_many(texts)
+    
+    def keys(self) -> List[str]:
+        """Keys of all stored annotations."""
+        return list(self._annotations)
+    
+    def flush(self):
+        """Wait until all saved annotations are written."""
+        if self._writer is not None:
+            self._writer.flush()
+    
+    def close(self):
+        """Write pending annotations and wait for the snapshot, so that no partial files are left."""
+        try:
+            if self._writer is not None:
+                self._writer.close()
+        finally:
+            if self._snapshot_thread is not None:
+                self._snapshot_thread.join()
+    
+    def add_listener(self, listener: Callable[[str], None]):
+        """Call `listener(key)` whenever a category status of `key` changes."""
+        self._listeners.append(listener)
+    
+    def get_status(self, cat: str, key: str) -> int:
+        """One of `UNSPECIFIED`, `ANNOTATED` or `MISSING`."""
+        return self._status.get(cat, {}).get(key, UNSPECIFIED)
+    
+    def get_status_array(self, cat: str, keys: Sequence[str]) -> np.ndarray:
+        """Statuses of `cat` for all `keys` as an int8 array."""
+        statuses = self._status.get(cat, {})
+        return np.fromiter(
+            (statuses.get(key, UNSPECIFIED) for key in keys), 
+            dtype=np.int8, count=len(keys)
+        )
+
+
+class SqliteAnnotationDatabase(AnnotationDatabase):
+    """Annotations of one frame folder stored in a single SQLite file.
+
+    One database file can hold a whole project; the annotations of each frame
+    folder are then distinguished by `folder`, the path of the folder relative
+    to the project.
+    """
+    _db_path: str
+    _folder: str
+    _connection: sqlite3.Connection
+
+    def __init__(self, db_path: str, folder: str = "", write_behind: bool = False, fsync: bool = False):
+        self._db_path = str(db_path)
+        self._folder = folder
+        self._connection = connect_sqlite(self._db_path)
+        if fsync:
+            self._connection.execute("PRAGMA synchronous=FULL")
+        self._setup(write_behind=write_behind, fsync=fsync)
+
+    def _preload_annotations(self):
+        rows = self._connection.execute(
+            "SELECT key, data FROM annotations WHERE folder = ?", (self._folder,))
+        self._annotations = {key: Annotation(**json.loads(data)) for key, data in rows}
+
+    def _write_annotations(self, items: List[Tuple[str, str]]):
+        rows = [(self._folder, key, text) for key, text in items]
+        with self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO annotations (folder, key, data) VALUES (?, ?, ?)", rows)
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self._connection.close()
+
+
+def connect_sqlite(db_path: str) -> sqlite3.Connection:
+    """Open (and create if necessary) an SQLite annotation store in WAL mode."""
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    # The connection is shared with the write-behind thread; sqlite3 serializes the access.
+    connection = sqlite3.connect(db_path, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS annotations ("
+        "folder TEXT NOT NULL, key TEXT NOT NULL, data TEXT NOT NULL, "
+        "PRIMARY KEY (folder, key)) WITHOUT ROWID"
+    )
+    return connection
@@ -1,11 +1,16 @@
 import numpy as np
 
-from typing import List, Set
+from typing import List, Set, Tuple, Dict, Optional
 from functools import partialmethod
 
 from piannot.annotation import Annotation
-from piannot.image_database import ImageDatabase
-from piannot.annotation_database import AnnotationDatabase
+from piannot.image_database import ImageDatabase, choose_reduce
+from piannot.annotation_database import AnnotationDatabase, UNSPECIFIED
+from piannot.interpolation import interpolate_annotations
+from piannot.predictions import PredictionDatabase
+from piannot.propagation import PointPropagator
+from piannot.tile_pyramid import TilePyramidCache
+from piannot.timing import timings
 
 import logging
 logger = logging.getLogger()
@@ -21,11 +26,19 @@ class Annotator:
     
     cats: List[str]
     active_cat: str
+    prefetch_radius: int = 4
+    display_reduce: int = 1
     
     
-    def __init__(self, image_db: ImageDatabase, annotation_db: AnnotationDatabase , cats:List[str]):
+    def __init__(self, image_db: ImageDatabase, annotation_db: AnnotationDatabase , cats:List[str],
+                 prediction_db: PredictionDatabase = None):
         self._image_db = image_db
         self._annotation_db = annotation_db
+        self._prediction_db = prediction_db
+        # Full-resolution pyramids of images for zoomed views.
+        self.tile_pyramids = TilePyramidCache(image_db)
+        self._propagator = None
+        self._propagated = None
         
         self.cats = cats
         self.active_cat = cats[0]
@@ -34,7 +47,8 @@ class Annotator:
         
             
     def _save_annotation(self):
-        self._annotation_db.save_annotation(annotation=self.annotation, key=self.image_key)
+        with timings.span("annotation_db.save"):
+            self._annotation_db.save_annotation(annotation=self.annotation, key=self.image_key)
         
     @property
     def image_key(self) -> str:
@@ -43,13 +57,13 @@ class Annotator:
     @image_key.setter
     def image_key(self, val: str):
         self._image_key = val
-        self._image = self._image_db.get_image(self._image_key)
-        self._annotation = self._annotation_db.load_annotation(self._image_key)
+        with timings.span("image_db.get_image"):
+            self._image = self._image_db.get_image(self._image_key, reduce=self.display_reduce)
+        with timings.span("annotation_db.load"):
+            self._annotation = self._annotation_db.load_annotation(self._image_key)
+        self._prefetch_neighbours()
         
-        logger.debug( 
-            f"Changed image to {self.image_key} "
-            f"and annotation to {self.annotation}."
-        )
+        logger.debug("Changed image to %s and annotation to %s.", self.image_key, self.annotation)
     
         
     @property
@@ -58,15 +72,53 @@ class Annotator:
     
     @property
     def image(self) -> np.ndarray:
+        """Current image, possibly decoded at reduced resolution."""
         return self._image
     
+    @property
+    def image_shape(self) -> Tuple[int, int]:
+        """Full-resolution `(height, width)` of the current image."""
+        return self._image_db.get_image_shape(self.image_key)
+    
+    @property
+    def image_extent(self) -> Tuple[float, float, float, float]:
+        """Extent `(left, right, bottom, top)` placing `image` in full-resolution pixel coordinates."""
+        height, width = self.image_shape
+        return (-0.5, width - 0.5, height - 0.5, -0.5)
+    
+    def set_display_size(self, width: int, height: int) -> bool:
+        """Decode images at the lowest resolution still covering `width` x `height` screen pixels.
+        
+        Returns whether the current image has been reloaded.
+        """
+        reduce = choose_reduce(self.image_shape, (width, height))
+        if reduce == self.display_reduce:
+            return False
+        logger.debug("Changing display_reduce to %d.", reduce)
+        self.display_reduce = reduce
+        self.image_key = self.image_key
+        return True
+    
     def get_image_keys(self) -> List[str]:
         return self._image_db.key_list
     
+    def _prefetch_neighbours(self):
+        """Let the image database decode images around the current one, nearest first."""
+        images = self._image_db.key_list
+        try:
+            i = self._image_db.index(self.image_key)
+        except ValueError:
+            return
+        
+        keys = []
+        for d in range(1, self.prefetch_radius + 1):
+            keys += [images[j] for j in (i + d, i - d) if 0 <= j < len(images)]
+        self._image_db.prefetch(keys, reduce=self.display_reduce)
+    
     def _move(self, step = 1):
         images = self._image_db.key_list
         try:
-            i = images.index(self.image_key)
+            i = self._image_db.index(self.image_key)
             i += step
             i = max(0, min(i, len(images) - 1))
         except ValueError:
@@ -102,6 +154,94 @@ class Annotator:
     def get_cat_state_description(self, cat:str = None):
         cat = cat or self.active_cat
         return self.annotation.get_cat_state_description(cat)
+    
+    @property
+    def predictions(self) -> Annotation:
+        """Predictions of current image: imported ones and, with propagation, the propagated points."""
+        if self._prediction_db is None:
+            predictions = Annotation()
+        else:
+            predictions = self._prediction_db.load_annotation(self.image_key)
+        if self._propagator is not None:
+            for cat, (x, y) in self._get_propagated_points().items():
+                if not predictions.get_points(cat):
+                    predictions.add_object(cat, x, y)
+        return predictions
+    
+    def set_propagation(self, enabled: bool):
+        """Predict points of unspecified categories from the previous images."""
+        self._propagator = PointPropagator() if enabled else None
+        self._propagated = None
+    
+    def _get_propagated_points(self) -> Dict[str, Tuple[float, float]]:
+        if self._propagated is None or self._propagated[0] != self.image_key:
+            with timings.span("propagation"):
+                self._propagated = (self.image_key, self._propagate_points())
+        return self._propagated[1]
+    
+    def _propagate_points(self) -> Dict[str, Tuple[float, float]]:
+        """Points of unspecified categories propagated from the first objects of the previous two images."""
+        keys = self._image_db.key_list
+        try:
+            i = self._image_db.index(self.image_key)
+        except ValueError:
+            return {}
+        if i == 0:
+            return {}
+        prev = self._annotation_db.load_annotation(keys[i - 1])
+        prev2 = self._annotation_db.load_annotation(keys[i - 2]) if i >= 2 else Annotation()
+        cats = [
+            cat for cat in self.cats
+            if prev.get_points(cat) and not self.annotation.get_points(cat) and not self.annotation.is_missing(cat)
+        ]
+        if not cats:
+            return {}
+        
+        # Propagate in the pixels of the displayed images, which are usually prefetched.
+        prev_image = self._image_db.get_image(keys[i - 1], reduce=self.display_reduce)
+        scale = self.image_shape[1] / self.image.shape[1]
+        to_image = lambda p: ((p[0] + 0.5) / scale - 0.5, (p[1] + 0.5) / scale - 0.5)
+        points = {}
+        for cat in cats:
+            p1 = prev.get_points(cat)[0]
+            p0 = prev2.get_points(cat)[0] if prev2.get_points(cat) else None
+            x, y = self._propagator.propagate(
+                prev_image, self.image, to_image(p1), to_image(p0) if p0 is not None else None)
+            points[cat] = ((x + 0.5) * scale - 0.5, (y + 0.5) * scale - 0.5)
+        return points
+    
+    def accept_predictions(self):
+        """Copy predictions of current image into categories of its annotation which are still unspecified."""
+        predictions = self.predictions
+        specified = self.annotation.annotated_cats() | self.annotation.missing
+        cats = predictions.annotated_cats() - specified
+        if not cats:
+            return
+        for cat in cats:
+            for x, y in predictions.get_points(cat):
+                self.annotation.add_object(cat, x, y, unique=False)
+        self._save_annotation()
+    
+    def interpolate(self, method: str = "linear") -> int:
+        """Fill images between keyframes of all categories; returns the number of interpolated objects."""
+        with timings.span("interpolation"):
+            n = interpolate_annotations(self._annotation_db, self._image_db.key_list, self.cats, method=method)
+        self._annotation = self._annotation_db.load_annotation(self.image_key)
+        return n
+    
+    def count_annotated(self) -> Dict[str, int]:
+        """Number of images with specified (annotated or missing) status of each category."""
+        keys = self._image_db.key_list
+        return {
+            cat: int(np.count_nonzero(self._annotation_db.get_status_array(cat, keys) != UNSPECIFIED))
+            for cat in self.cats
+        }
+    
+    def close(self):
+        """Release background resources of the databases."""
+        self.tile_pyramids.close()
+        self._image_db.close()
+        self._annotation_db.close()
         
     
         
@@ -2,29 +2,65 @@ from pathlib import Path
 from typing import List
 
 from piannot import data_dir
-from piannot.annotation_database import AnnotationDatabase
+from piannot.annotation_database import AnnotationDatabase, SqliteAnnotationDatabase
 from piannot.annotator import Annotator
-from piannot.image_database import ImageDatabase
+from piannot.image_database import ImageDatabase, PrefetchingImageDatabase
+from piannot.folder_index import FolderIndex, find_first_frame_dir
+from piannot.predictions import PredictionDatabase
+from piannot.packed_frames import PackedImageDatabase, is_packed_dir
 
 
 class AnnotatorSelector:
-    def __init__(self, cats: List[str], parent_frame_dir: Path = None, parent_annot_dir: Path = None):
+    def __init__(self, cats: List[str], parent_frame_dir: Path = None, parent_annot_dir: Path = None,
+                 annotation_backend: str = "json", fsync: bool = False):
+        """`annotation_backend` is either "json" (one file per frame) or "sqlite" (one file per project).
+
+        Annotations are written on a background thread; with `fsync` each write is flushed to the disk.
+        Frame folders are looked up in a `FolderIndex`, refreshed in the background.
+        """
         self.cats = cats
         self.parent_frame_dir = parent_frame_dir or data_dir / "frames"
         self.parent_annot_dir = parent_annot_dir or data_dir / "annotations"
+        self.annotation_backend = annotation_backend
+        self.fsync = fsync
+
+        self.folder_index = FolderIndex(
+            self.parent_frame_dir, self.parent_annot_dir, cats,
+            sqlite_path=self.sqlite_path if annotation_backend == "sqlite" else None
+        )
+        folders = self.folder_index.frame_folders()
+        self.frame_dir = self.parent_frame_dir / folders[0] if folders else find_first_frame_dir(self.parent_frame_dir)
+        self.folder_index.refresh_in_background()
 
-        for frame in self.parent_frame_dir.glob("**/*.jpg"):
-            break
-        self.frame_dir = frame.parent
+    @property
+    def folder(self) -> str:
+        """Current frame folder relative to `parent_frame_dir`."""
+        folder = self.frame_dir.relative_to(self.parent_frame_dir).as_posix()
+        return "" if folder == "." else folder
 
     @property
     def annot_dir(self) -> Path:
         return self.parent_annot_dir / self.frame_dir.relative_to(self.parent_frame_dir)
 
+    @property
+    def sqlite_path(self) -> Path:
+        return self.parent_annot_dir / "annotations.sqlite"
+
+    def get_annotation_db(self) -> AnnotationDatabase:
+        if self.annotation_backend == "sqlite":
+            return SqliteAnnotationDatabase(self.sqlite_path, folder=self.folder, write_behind=True, fsync=self.fsync)
+        return AnnotationDatabase(self.annot_dir, write_behind=True, fsync=self.fsync)
+
+    def get_image_db(self) -> ImageDatabase:
+        if is_packed_dir(self.frame_dir):
+            return PackedImageDatabase(self.frame_dir)
+        return PrefetchingImageDatabase(self.frame_dir)
+
     def get_annotator(self):
         return Annotator(
-            image_db=ImageDatabase(self.frame_dir),
-            annotation_db=AnnotationDatabase(self.annot_dir),
-            cats=self.cats
+            image_db=self.get_image_db(),
+            annotation_db=self.get_annotation_db(),
+            cats=self.cats,
+            prediction_db=PredictionDatabase(self.annot_dir)
         )
 
@@ -0,0 +1,337 @@
+"""Benchmarks of piannot on synthetic datasets. Run `python benchmark.py --help`."""
+import contextlib
+import gc
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import List, Sequence, Callable
+
+import numpy as np
+import PIL.Image
+
+from piannot.annotation import Annotation
+from piannot.annotation_database import AnnotationDatabase
+
+CATS = ("ball", "head1", "head2")
+
+
+def _random_annotation_dicts(n: int, cats: List[str], seed: int = 0) -> List[dict]:
+    rng = random.Random(seed)
+    dics = []
+    for _ in range(n):
+        objects, missing = [], []
+        for cat in cats:
+            r = rng.random()
+            if r < 0.6:
+                objects.append({"cat": cat, "x": rng.uniform(0, 1920), "y": rng.uniform(0, 1080)})
+            elif r < 0.8:
+                missing.append(cat)
+        dics.append({"objects": objects, "missing": missing})
+    return dics
+
+
+def _traced_size(build) -> int:
+    gc.collect()
+    tracemalloc.start()
+    obj = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del obj
+    return size
+
+
+def benchmark_annotation_memory(n: int = 100_000, cats: List[str] = CATS) -> dict:
+    """Memory of `n` annotations as `Annotation` objects and as parsed json dicts."""
+    dics = _random_annotation_dicts(n, list(cats))
+    texts = [json.dumps(dic) for dic in dics]
+    del dics
+    annotation_bytes = _traced_size(lambda: [Annotation(**json.loads(t)) for t in texts])
+    dict_bytes = _traced_size(lambda: [json.loads(t) for t in texts])
+    return {
+        "n_annotations": n,
+        "annotation_bytes": annotation_bytes,
+        "dict_bytes": dict_bytes,
+        "annotation_bytes_per_item": annotation_bytes / n,
+        "dict_bytes_per_item": dict_bytes / n,
+    }
+
+
+####### Synthetic datasets ########
+
+def _synthetic_frame(i: int, width: int, height: int, rng: np.random.Generator) -> np.ndarray:
+    """Moving gradient with noise, so that jpgs and videos have realistic sizes."""
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    frame = np.empty((height, width, 3), dtype=np.float32)
+    frame[..., 0] = (x + 4 * i) % 256
+    frame[..., 1] = y
+    frame[..., 2] = (x + y) / 2
+    frame += rng.normal(0, 8, size=(height, width, 1))
+    return np.clip(frame, 0, 255).astype(np.uint8)
+
+
+def make_dataset(root: Path, n_frames: int = 1000, width: int = 1280, height: int = 720, n_folders: int = 1,
+                 density: float = 0.5, cats: Sequence[str] = CATS, seed: int = 0) -> dict:
+    """Write jpg frames into `root/frames/video_<i>` and json annotations into `root/annotations/video_<i>`.
+
+    Each category of each frame is annotated with probability `density`
+    (a tenth of them as missing). Frames repeat every 50 frames to keep the
+    generation fast. Returns the parameters of the dataset.
+    """
+    rng = np.random.default_rng(seed)
+    pattern = [
+        PIL.Image.fromarray(_synthetic_frame(i, width, height, rng))
+        for i in range(min(50, n_frames))
+    ]
+    for folder in range(n_folders):
+        frame_dir = root / "frames" / f"video_{folder}"
+        annot_dir = root / "annotations" / f"video_{folder}"
+        frame_dir.mkdir(parents=True, exist_ok=True)
+        annot_dir.mkdir(parents=True, exist_ok=True)
+        for i in range(n_frames):
+            key = f"frame_{i:05d}"
+            pattern[i % len(pattern)].save(frame_dir / f"{key}.jpg", quality=90)
+            annotation = Annotation()
+            for cat in cats:
+                r = rng.random()
+                if r < density * 0.9:
+                    annotation.add_object(cat, rng.uniform(0, width), rng.uniform(0, height))
+                elif r < density:
+                    annotation.add_missing(cat)
+            annotation.to_json(str(annot_dir / f"{key}.json"))
+    return {"n_frames": n_frames, "width": width, "height": height, "n_folders": n_folders,
+            "density": density, "cats": list(cats), "seed": seed}
+
+
+def make_video(path: Path, n_frames: int = 250, width: int = 1280, height: int = 720, fps: float = 25,
+               seed: int = 0):
+    """Write a synthetic h264 mp4 video."""
+    import imageio_ffmpeg
+    rng = np.random.default_rng(seed)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    writer = imageio_ffmpeg.write_frames(str(path), (width, height), fps=fps, macro_block_size=1)
+    writer.send(None)
+    for i in range(n_frames):
+        writer.send(_synthetic_frame(i, width, height, rng))
+    writer.close()
+
+
+####### Benchmarks ########
+
+def _latency_stats(ms: Sequence[float]) -> dict:
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {"n": len(ms), "mean_ms": float(np.mean(ms)), "p50_ms": p50, "p95_ms": p95, "p99_ms": p99,
+            "max_ms": float(np.max(ms))}
+
+
+def _time_ms(fn: Callable) -> float:
+    start = time.perf_counter()
+    fn()
+    return 1000 * (time.perf_counter() - start)
+
+
+def _remove_snapshots(annot_dir: Path):
+    from piannot.annotation_database import SNAPSHOT_NAME
+    for path in annot_dir.glob(f"**/{SNAPSHOT_NAME}"):
+        path.unlink()
+
+
+def benchmark_startup(root: Path, cats: Sequence[str] = CATS) -> dict:
+    """Time of `AnnotatorSelector` and `AnnotationDatabase` construction, without and with a snapshot."""
+    from piannot.annotator_selector import AnnotatorSelector
+    from piannot.folder_index import FOLDER_INDEX_NAME
+    started = []
+
+    def start():
+        selector = AnnotatorSelector(list(cats), root / "frames", root / "annotations")
+        started.append(selector.get_annotation_db())
+        selector.folder_index.wait()
+
+    def timed_start() -> float:
+        ms = _time_ms(start)
+        # Closing waits for the snapshot written in the background, which is not part of the startup.
+        started.pop().close()
+        return ms
+
+    (root / "annotations" / FOLDER_INDEX_NAME).unlink(missing_ok=True)
+    _remove_snapshots(root / "annotations")
+    cold_ms = timed_start()
+    warm_ms = [timed_start() for _ in range(5)]
+    return {"cold_ms": cold_ms, "warm": _latency_stats(warm_ms)}
+
+
+def benchmark_navigation(root: Path, n_steps: int = 200, prefetch: bool = True, cats: Sequence[str] = CATS) -> dict:
+    """Latency of `Annotator.next_image` over the first frame folder."""
+    from piannot.annotator import Annotator
+    from piannot.image_database import ImageDatabase, PrefetchingImageDatabase
+    image_db_class = PrefetchingImageDatabase if prefetch else ImageDatabase
+    annotator = Annotator(
+        image_db=image_db_class(str(root / "frames" / "video_0")),
+        annotation_db=AnnotationDatabase(str(root / "annotations" / "video_0")),
+        cats=list(cats)
+    )
+    try:
+        latencies = []
+        for _ in range(n_steps):
+            latencies.append(_time_ms(annotator.next_image))
+            # Leave some time for prefetching as a human annotator would.
+            time.sleep(0.01)
+        return _latency_stats(latencies)
+    finally:
+        annotator.close()
+
+
+def benchmark_save(root: Path, n_saves: int = 1000, write_behind: bool = False) -> dict:
+    """Throughput of `AnnotationDatabase.save_annotation` into an empty folder."""
+    annot_dir = root / "bench_save"
+    shutil.rmtree(annot_dir, ignore_errors=True)
+    db = AnnotationDatabase(str(annot_dir), write_behind=write_behind)
+    annotations = [Annotation(objects=[{"cat": "ball", "x": i, "y": i}]) for i in range(n_saves)]
+    start = time.perf_counter()
+    for i, annotation in enumerate(annotations):
+        db.save_annotation(annotation, f"frame_{i:05d}")
+    db.close()
+    seconds = time.perf_counter() - start
+    shutil.rmtree(annot_dir)
+    return {"n_saves": n_saves, "write_behind": write_behind, "seconds": seconds, "saves_per_s": n_saves / seconds}
+
+
+def benchmark_count(root: Path) -> dict:
+    """Time of `count_annotated_objects_in_folder` over the whole annotation tree."""
+    from piannot.count_annotations import count_annotated_objects_in_folder
+    start = time.perf_counter()
+    count = count_annotated_objects_in_folder(str(root / "annotations"))
+    return {"n_objects": count, "ms": 1000 * (time.perf_counter() - start)}
+
+
+def benchmark_extraction(root: Path, n_frames: int = 250, width: int = 1280, height: int = 720,
+                         workers: int = 2) -> dict:
+    """Frames per second of extracting every frame of a synthetic video."""
+    from piannot.extract_frames_from_videos import extract_frames_from_one_video
+    video_path = root / "videos" / "synthetic.mp4"
+    if not video_path.exists():
+        make_video(video_path, n_frames=n_frames, width=width, height=height)
+    out_folder = root / "extracted"
+    shutil.rmtree(out_folder, ignore_errors=True)
+    start = time.perf_counter()
+    # Keep stdout for the json results.
+    with contextlib.redirect_stdout(sys.stderr):
+        count = extract_frames_from_one_video(video_path, out_folder, workers=workers, resume=False)
+    seconds = time.perf_counter() - start
+    shutil.rmtree(out_folder)
+    return {"n_frames": count, "seconds": seconds, "frames_per_s": count / seconds}
+
+
+def benchmark_gui(root: Path, n_steps: int = 50, cats: Sequence[str] = CATS) -> dict:
+    """Latency of navigation and clicks in the main window, run under Qt's offscreen platform."""
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    import PyQt5.QtWidgets as qtw
+    from piannot.annotator_selector import AnnotatorSelector
+    from piannot.gui import MainWindow
+
+    app = qtw.QApplication.instance() or qtw.QApplication([])
+    window = MainWindow(AnnotatorSelector(list(cats), root / "frames", root / "annotations"))
+    window.resize(1200, 900)
+    app.processEvents()
+    widget = window.main_widget
+
+    def step(action):
+        action()
+        app.processEvents()
+
+    try:
+        navigation = [_time_ms(lambda: step(widget.next_image)) for _ in range(n_steps)]
+        clicks = [_time_ms(lambda: step(lambda: widget.mouse_pressed_on_canvas(100., 100.))) for _ in range(n_steps)]
+        return {"navigation": _latency_stats(navigation), "click": _latency_stats(clicks)}
+    finally:
+        window.close()
+
+
+BENCHMARKS = ("memory", "startup", "navigation", "save", "count", "extraction", "gui")
+
+
+def run_benchmarks(root: Path, names: Sequence[str] = BENCHMARKS, n_frames: int = 1000, width: int = 1280,
+                   height: int = 720, density: float = 0.5, n_annotations: int = 100_000, seed: int = 0) -> dict:
+    """Generate a dataset in `root` (unless present) and run the benchmarks `names`."""
+    dataset_path = root / "dataset.json"
+    params = {"n_frames": n_frames, "width": width, "height": height, "density": density, "seed": seed}
+    if not dataset_path.exists() or json.loads(dataset_path.read_text()) != params:
+        shutil.rmtree(root / "frames", ignore_errors=True)
+        shutil.rmtree(root / "annotations", ignore_errors=True)
+        make_dataset(root, n_frames=n_frames, width=width, height=height, density=density, seed=seed)
+        dataset_path.write_text(json.dumps(params))
+
+    benchmarks = {
+        "memory": lambda: benchmark_annotation_memory(n_annotations),
+        "startup": lambda: benchmark_startup(root),
+        "navigation": lambda: {
+            "prefetching": benchmark_navigation(root, prefetch=True),
+            "plain": benchmark_navigation(root, prefetch=False),
+        },
+        "save": lambda: {
+            "sync": benchmark_save(root),
+            "write_behind": benchmark_save(root, write_behind=True),
+        },
+        "count": lambda: benchmark_count(root),
+        "extraction": lambda: benchmark_extraction(root, width=width, height=height),
+        "gui": lambda: benchmark_gui(root),
+    }
+    results = {name: benchmarks[name]() for name in names}
+    return {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": np.__version__,
+            "cpu_count": os.cpu_count(),
+            "dataset": params,
+        },
+        "results": results,
+    }
+
+
+def _retrieve_cmd_line_args():
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--only", nargs="+", choices=BENCHMARKS, default=BENCHMARKS,
+                        help="Run only these benchmarks.")
+    parser.add_argument("--work_dir", default=None,
+                        help="Folder for the synthetic dataset, kept between runs. Defaults to a temporary folder.")
+    parser.add_argument("--out_file", default=None, help="Write the json results to this file.")
+    parser.add_argument("--n_frames", type=int, default=1000, help="Number of synthetic frames.")
+    parser.add_argument("--width", type=int, default=1280, help="Width of synthetic frames.")
+    parser.add_argument("--height", type=int, default=720, help="Height of synthetic frames.")
+    parser.add_argument("--density", type=float, default=0.5,
+                        help="Probability that a category of a frame is annotated.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic dataset.")
+    parser.add_argument("--n_annotations", type=int, default=100_000,
+                        help="Number of annotations in the memory benchmark.")
+    return parser.parse_args()
+
+
+def _main():
+    args = _retrieve_cmd_line_args()
+    work_dir = Path(args.work_dir) if args.work_dir else Path(tempfile.mkdtemp(prefix="piannot_benchmark_"))
+    try:
+        results = run_benchmarks(
+            work_dir, names=args.only, n_frames=args.n_frames, width=args.width, height=args.height,
+            density=args.density, n_annotations=args.n_annotations, seed=args.seed
+        )
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.out_file:
+        Path(args.out_file).write_text(text)
+
+
+if __name__ == "__main__":
+    _main()
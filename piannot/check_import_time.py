@@ -0,0 +1,87 @@
+"""Check import times of the piannot entry points against budgets using `python -X importtime`.
+
+Exits with status 1 if an entry point exceeds its budget or imports a forbidden module.
+"""
+import json
+import re
+import subprocess
+import sys
+from typing import Dict, Set, Tuple
+
+GUI_MODULES = ("PyQt5", "matplotlib", "moviepy")
+
+# Entry point: (budget of the cumulative import time in ms, top-level modules it must not import).
+BUDGETS = {
+    "piannot.annotation": (50, GUI_MODULES + ("numpy",)),
+    "piannot.count_annotations": (100, GUI_MODULES + ("numpy",)),
+    "piannot.annotation_database": (300, GUI_MODULES),
+    "piannot.export_annotations": (300, GUI_MODULES),
+    "piannot.predictions": (300, GUI_MODULES),
+    "piannot.interpolation": (300, GUI_MODULES),
+    "piannot.migrate_annotations": (300, GUI_MODULES),
+    # Only Qt is imported before the window is shown, the rest is loaded by `_run`.
+    "piannot.run": (300, ("matplotlib", "moviepy", "numpy")),
+    "piannot.gui": (1500, ("moviepy",)),
+    "piannot.extract_frames_from_videos": (1000, ("PyQt5", "matplotlib")),
+}
+
+_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+
+def measure_import(module: str) -> Tuple[float, Set[str]]:
+    """Cumulative import time in ms of `module` in a fresh interpreter and the top-level packages it imports."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, check=True
+    )
+    cumulative_ms, imported = None, set()
+    for line in result.stderr.splitlines():
+        match = _LINE.match(line)
+        if match is None:
+            continue
+        name = match.group(4)
+        imported.add(name.split(".")[0])
+        if name == module:
+            cumulative_ms = int(match.group(2)) / 1000
+    return cumulative_ms, imported
+
+
+def check_import_times(repeat: int = 3, scale: float = 1.) -> Dict[str, dict]:
+    """Best of `repeat` import times of all entry points, checked against budgets multiplied by `scale`."""
+    report = {}
+    for module, (budget_ms, forbidden) in BUDGETS.items():
+        runs = [measure_import(module) for _ in range(repeat)]
+        ms = min(ms for ms, _ in runs)
+        forbidden_imported = sorted(set(forbidden) & runs[0][1])
+        report[module] = {
+            "ms": ms,
+            "budget_ms": budget_ms * scale,
+            "forbidden_imported": forbidden_imported,
+            "ok": ms <= budget_ms * scale and not forbidden_imported,
+        }
+    return report
+
+
+def _retrieve_cmd_line_args():
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=3, help="Take the best of this many runs.")
+    parser.add_argument("--scale", type=float, default=1., help="Multiply all budgets, e.g. on slow machines.")
+    parser.add_argument("--json", action="store_true", help="Print the report as json.")
+    return parser.parse_args()
+
+
+def _main():
+    args = _retrieve_cmd_line_args()
+    report = check_import_times(repeat=args.repeat, scale=args.scale)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for module, r in report.items():
+            problems = f"  imports {', '.join(r['forbidden_imported'])}" if r["forbidden_imported"] else ""
+            print(f"{'ok  ' if r['ok'] else 'FAIL'} {module:40} {r['ms']:7.1f} ms / {r['budget_ms']:.0f} ms{problems}")
+    sys.exit(0 if all(r["ok"] for r in report.values()) else 1)
+
+
+if __name__ == "__main__":
+    _main()
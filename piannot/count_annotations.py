@@ -1,67 +1,171 @@
 import os
-from annotation import Annotation
-from typing import Tuple
+import json
+from concurrent.futures import ProcessPoolExecutor
+from piannot.annotation import Annotation
+from piannot.fileio import atomic_write_text
+from typing import Tuple, Dict, List, Iterator, Optional
+
+# Counts of one annotation file: objects per category and missing categories.
+FileCounts = Tuple[Dict[str, int], List[str]]
+
+
+def _scan_jsons(folder: str, recursive: bool) -> Iterator[Tuple[str, int, int]]:
+    """Yield `(path, mtime_ns, size)` of json files in `folder`."""
+    stack = [folder]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    if recursive:
+                        stack.append(entry.path)
+                elif os.path.splitext(entry.name)[1] == ".json":
+                    stat = entry.stat()
+                    yield entry.path, stat.st_mtime_ns, stat.st_size
+
+
+def _count_file(path: str) -> FileCounts:
+    ann = Annotation.load(path)
+    return {cat: len(ann.get_points(cat)) for cat in ann.annotated_cats()}, sorted(ann.missing)
+
+
+def _load_manifest(manifest_path: Optional[str]) -> dict:
+    if manifest_path and os.path.exists(manifest_path):
+        with open(manifest_path, "rt") as file:
+            return json.load(file)
+    return {}
+
+
+def _save_manifest(manifest_path: str, manifest: dict):
+    atomic_write_text(manifest_path, json.dumps(manifest))
+
+
+def count_annotations(folder: str, recursive: bool = True, manifest_path: str = None,
+                      n_workers: int = None) -> Dict[str, FileCounts]:
+    """Counts of all annotation files in `folder`, by path.
+
+    Files are parsed in a process pool. With `manifest_path` the counts are
+    cached there by `(path, mtime, size)` and only changed files are parsed on
+    repeated runs.
+    """
+    manifest = _load_manifest(manifest_path)
+    counts = {}
+    stale = []
+    for path, mtime, size in _scan_jsons(folder, recursive):
+        cached = manifest.get(path)
+        if cached is not None and cached[:2] == [mtime, size]:
+            counts[path] = (cached[2], cached[3])
+        else:
+            stale.append((path, mtime, size))
+
+    if len(stale) > 100:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            parsed = list(executor.map(_count_file, [p for p, _, _ in stale], chunksize=256))
+    else:
+        parsed = [_count_file(p) for p, _, _ in stale]
+
+    for (path, mtime, size), file_counts in zip(stale, parsed):
+        counts[path] = file_counts
+        manifest[path] = [mtime, size, *file_counts]
+
+    if manifest_path and (stale or len(manifest) != len(counts)):
+        _save_manifest(manifest_path, {path: manifest[path] for path in counts})
+    return counts
+
 
 def count_annotated_objects_in_folder(folder:str, recursive:bool=True) -> int:
-    jsons = [
-        os.path.join(folder, f) for f in os.listdir(folder) 
-        if os.path.splitext(f)[1] == ".json"
-    ]
-    count = 0
-    for f in jsons:
-        ann =  Annotation.load(f)
-        count += len(ann.objects) + len(ann.missing)
-        
-    if recursive:
-        subfolders = [
-            os.path.join(folder, f)
-            for f in os.listdir(folder)
-            if os.path.isdir(os.path.join(folder, f))
-        ]
-        count += sum(
-            count_annotated_objects_in_folder(subfolder, True)
-            for subfolder in subfolders
-        )
-        
-    return count
-
-def _retrieve_cmd_line_args() -> Tuple[str, str]:
+    counts = count_annotations(folder, recursive=recursive)
+    return sum(sum(objects.values()) + len(missing) for objects, missing in counts.values())
+
+
+def _count_frames(frame_dir: str) -> int:
+    with os.scandir(frame_dir) as entries:
+        return sum(os.path.splitext(e.name)[1] == ".jpg" for e in entries)
+
+
+def summarize(counts: Dict[str, FileCounts], folder: str, frame_dir: str = None) -> dict:
+    """Total, per-category and per-folder statistics.
+
+    With `frame_dir` (the frame folder mirrored by `folder`) each folder also
+    reports the number of frames and the fraction of them having an annotation.
+    """
+    cats = {}
+    folders = {}
+    for path, (objects, missing) in counts.items():
+        rel_folder = os.path.relpath(os.path.dirname(path), folder).replace(os.sep, "/")
+        f = folders.setdefault(rel_folder, {"files": 0, "objects": 0, "missing": 0})
+        f["files"] += 1
+        f["objects"] += sum(objects.values())
+        f["missing"] += len(missing)
+        for cat, n in objects.items():
+            cats.setdefault(cat, {"objects": 0, "missing": 0})["objects"] += n
+        for cat in missing:
+            cats.setdefault(cat, {"objects": 0, "missing": 0})["missing"] += 1
+
+    if frame_dir is not None:
+        for rel_folder, f in folders.items():
+            frames_path = os.path.join(frame_dir, rel_folder)
+            f["frames"] = _count_frames(frames_path) if os.path.isdir(frames_path) else 0
+            f["completion"] = f["files"] / f["frames"] if f["frames"] else None
+
+    return {
+        "total": sum(f["objects"] + f["missing"] for f in folders.values()),
+        "categories": dict(sorted(cats.items())),
+        "folders": dict(sorted(folders.items())),
+    }
+
+
+def _save_csv(summary: dict, csv_file: str):
+    import csv
+    columns = ["folder", "files", "objects", "missing", "frames", "completion"]
+    with open(csv_file, "wt", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=columns, extrasaction="ignore")
+        writer.writeheader()
+        for rel_folder, f in summary["folders"].items():
+            writer.writerow({"folder": rel_folder, **f})
+
+
+def _retrieve_cmd_line_args():
     import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument("folder", help = "folder containig annotations")
-    
-    parser.add_argument("--out_file", 
+
+    parser.add_argument("--out_file",
         type = str,
         help = "Text file where to write the output.",
         default = None
     )
-    args = parser.parse_args()
-    
-    return args.folder, args.out_file
+    parser.add_argument("--manifest", default=None,
+                        help="Json file caching counts of unchanged files between runs.")
+    parser.add_argument("--frame_dir", default=None,
+                        help="Frame folder mirrored by `folder`, used to report per-folder completion.")
+    parser.add_argument("--json", default=None, help="Json file where to write detailed statistics.")
+    parser.add_argument("--csv", default=None, help="Csv file where to write per-folder statistics.")
+    parser.add_argument("--workers", type=int, default=None, help="Number of parsing processes.")
+    return parser.parse_args()
 
 def _save_to_file(count:int, out_file: str):
     import datetime
     now = datetime.datetime.now()
-    
+
     out_string = f"{now:%D %H:%M} {count}"
     print(f"Saving '{out_string}' to {out_file}")
-    
+
     with open(out_file, "at") as file:
         file.write("\n" + out_string)
-    
-    
+
+
 if __name__ == "__main__":
-    folder, out_file = _retrieve_cmd_line_args()
-    
-    count = count_annotated_objects_in_folder(folder = folder)
+    args = _retrieve_cmd_line_args()
+
+    counts = count_annotations(args.folder, manifest_path=args.manifest, n_workers=args.workers)
+    summary = summarize(counts, args.folder, frame_dir=args.frame_dir)
+    count = summary["total"]
     print(count)
-    
-    if out_file:
-        _save_to_file(count, out_file)
-        
-        
-        
-    
-    
-    
-    
\ No newline at end of file
+
+    if args.out_file:
+        _save_to_file(count, args.out_file)
+    if args.json:
+        with open(args.json, "wt") as file:
+            json.dump(summary, file, indent=2)
+    if args.csv:
+        _save_csv(summary, args.csv)
@@ -0,0 +1,251 @@
+"""Export of an annotation tree to columnar NumPy arrays, COCO keypoints or YOLO labels."""
+import collections
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterator, List, Tuple, Dict, Callable
+
+import numpy as np
+
+from piannot.annotation_database import AnnotationDatabase, SqliteAnnotationDatabase, connect_sqlite
+
+# Columns of the export: frame index, category index, coordinates and missing flag.
+COLUMNS = {
+    "frame": np.int32,
+    "cat": np.int16,
+    "x": np.float32,
+    "y": np.float32,
+    "missing": np.bool_,
+}
+
+
+def _json_folders(annot_dir: Path) -> List[str]:
+    """Folders of `annot_dir` (relative, posix) containing json annotations."""
+    folders = []
+    for dirpath, _, filenames in os.walk(annot_dir):
+        if any(os.path.splitext(f)[1] == ".json" for f in filenames):
+            folder = Path(dirpath).relative_to(annot_dir).as_posix()
+            folders.append("" if folder == "." else folder)
+    return sorted(folders)
+
+
+def _sqlite_folders(db_path: Path) -> List[str]:
+    connection = connect_sqlite(str(db_path))
+    try:
+        return [folder for folder, in connection.execute("SELECT DISTINCT folder FROM annotations ORDER BY folder")]
+    finally:
+        connection.close()
+
+
+def _ordered_parallel_map(fn: Callable, items: List, workers: int) -> Iterator:
+    """Like `map` but with `workers` threads and at most `workers` results held in memory."""
+    if workers <= 1:
+        yield from map(fn, items)
+        return
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = collections.deque()
+        for item in items:
+            futures.append(executor.submit(fn, item))
+            if len(futures) >= workers:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
+
+
+def iter_annotation_dbs(annot_dir: Path = None, sqlite_path: Path = None,
+                        workers: int = 1) -> Iterator[Tuple[str, AnnotationDatabase]]:
+    """Yield `(folder, annotation_db)` for all frame folders of an annotation tree or SQLite project."""
+    if sqlite_path is not None:
+        folders = _sqlite_folders(sqlite_path)
+        load = lambda folder: SqliteAnnotationDatabase(sqlite_path, folder=folder)
+    else:
+        folders = _json_folders(annot_dir)
+        load = lambda folder: AnnotationDatabase(str(annot_dir / folder), read_only=True)
+    yield from zip(folders, _ordered_parallel_map(load, folders, workers))
+
+
+def iter_column_chunks(dbs: Iterator[Tuple[str, AnnotationDatabase]], cats: List[str],
+                       frames: List[str]) -> Iterator[Dict[str, np.ndarray]]:
+    """Yield the columns of each annotation database. Frame paths `folder/key` are appended to `frames`.
+
+    Objects of categories not in `cats` are skipped.
+    """
+    cat_ids = {cat: i for i, cat in enumerate(cats)}
+    for folder, db in dbs:
+        rows = []
+        for key in sorted(db.keys()):
+            annotation = db.load_annotation(key)
+            frame_id = len(frames)
+            frames.append(f"{folder}/{key}" if folder else key)
+            for cat in annotation.annotated_cats() & cat_ids.keys():
+                rows += [(frame_id, cat_ids[cat], x, y, False) for x, y in annotation.get_points(cat)]
+            rows += [(frame_id, cat_ids[cat], np.nan, np.nan, True) for cat in annotation.missing & cat_ids.keys()]
+        db.close()
+        if rows:
+            columns = list(zip(*rows))
+            yield {name: np.array(col, dtype=dtype) for (name, dtype), col in zip(COLUMNS.items(), columns)}
+
+
+def _write_npy_from_raw(raw_path: Path, npy_path: Path, dtype, n_rows: int):
+    with open(npy_path, "wb") as out, open(raw_path, "rb") as raw:
+        header = {"descr": np.lib.format.dtype_to_descr(np.dtype(dtype)), "fortran_order": False, "shape": (n_rows,)}
+        np.lib.format.write_array_header_1_0(out, header)
+        shutil.copyfileobj(raw, out)
+    os.remove(raw_path)
+
+
+def export_columns(out_dir: Path, cats: List[str], annot_dir: Path = None, sqlite_path: Path = None,
+                   workers: int = 1, npz: bool = False) -> int:
+    """Export annotations to `out_dir` as one `.npy` file per column plus `meta.json`.
+
+    The columns are written in chunks, one frame folder at a time, so memory
+    stays bounded. The `.npy` files can be loaded with `np.load(..., mmap_mode="r")`.
+    With `npz` they are bundled into `annotations.npz` instead. Returns the number of rows.
+    """
+    out_dir.mkdir(parents=True, exist_ok=True)
+    frames = []
+    raw_files = {name: open(out_dir / f"{name}.raw", "wb") for name in COLUMNS}
+    n_rows = 0
+    try:
+        dbs = iter_annotation_dbs(annot_dir=annot_dir, sqlite_path=sqlite_path, workers=workers)
+        for chunk in iter_column_chunks(dbs, cats, frames):
+            for name, col in chunk.items():
+                raw_files[name].write(col.tobytes())
+            n_rows += len(chunk["frame"])
+    finally:
+        for file in raw_files.values():
+            file.close()
+
+    for name, dtype in COLUMNS.items():
+        _write_npy_from_raw(out_dir / f"{name}.raw", out_dir / f"{name}.npy", dtype, n_rows)
+
+    if npz:
+        arrays = {name: np.load(out_dir / f"{name}.npy", mmap_mode="r") for name in COLUMNS}
+        np.savez(out_dir / "annotations.npz", **arrays)
+        del arrays
+        for name in COLUMNS:
+            os.remove(out_dir / f"{name}.npy")
+
+    with open(out_dir / "meta.json", "wt") as file:
+        json.dump({"cats": cats, "frames": frames, "n_rows": n_rows}, file)
+    return n_rows
+
+
+def load_columns(out_dir: Path) -> Tuple[Dict[str, np.ndarray], dict]:
+    """Columns (memory-mapped if possible) and metadata of an export."""
+    with open(out_dir / "meta.json", "rt") as file:
+        meta = json.load(file)
+    if (out_dir / "annotations.npz").exists():
+        with np.load(out_dir / "annotations.npz") as npz:
+            columns = dict(npz)
+    else:
+        columns = {name: np.load(out_dir / f"{name}.npy", mmap_mode="r") for name in COLUMNS}
+    return columns, meta
+
+
+def _image_size(frame_dir: Path, frame: str) -> Tuple[int, int]:
+    import PIL.Image
+    with PIL.Image.open(frame_dir / (frame + ".jpg")) as img:
+        return img.size
+
+
+def _frame_groups(columns: Dict[str, np.ndarray]) -> Iterator[Tuple[int, np.ndarray]]:
+    """Yield `(frame_id, row_indices)` for each frame with rows; rows are sorted by frame already."""
+    frame = np.asarray(columns["frame"])
+    if len(frame) == 0:
+        return
+    starts = np.flatnonzero(np.diff(frame, prepend=-1))
+    ends = np.append(starts[1:], len(frame))
+    for start, end in zip(starts, ends):
+        yield int(frame[start]), np.arange(start, end)
+
+
+def to_coco_keypoints(out_dir: Path, frame_dir: Path, coco_path: Path):
+    """Write a COCO keypoints file with one instance per frame and one keypoint per category.
+
+    Keypoints of unspecified and missing categories have visibility 0.
+    Only the first object of each category is used.
+    """
+    columns, meta = load_columns(out_dir)
+    cats = meta["cats"]
+    images, annotations = [], []
+    for frame_id, rows in _frame_groups(columns):
+        frame = meta["frames"][frame_id]
+        width, height = _image_size(frame_dir, frame)
+        images.append({"id": frame_id, "file_name": frame + ".jpg", "width": width, "height": height})
+        keypoints = np.zeros((len(cats), 3))
+        for row in rows[::-1]:
+            if not columns["missing"][row]:
+                keypoints[columns["cat"][row]] = (columns["x"][row], columns["y"][row], 2)
+        annotations.append({
+            "id": frame_id, "image_id": frame_id, "category_id": 1, "iscrowd": 0,
+            "keypoints": keypoints.ravel().tolist(), "num_keypoints": int((keypoints[:, 2] > 0).sum()),
+        })
+    coco = {
+        "images": images,
+        "annotations": annotations,
+        "categories": [{"id": 1, "name": "frame", "keypoints": cats, "skeleton": []}],
+    }
+    with open(coco_path, "wt") as file:
+        json.dump(coco, file)
+
+
+def to_yolo(out_dir: Path, frame_dir: Path, labels_dir: Path, box_size: float = 20):
+    """Write YOLO label files `labels_dir/<frame>.txt` with `box_size` pixel boxes around the objects."""
+    columns, meta = load_columns(out_dir)
+    for frame_id, rows in _frame_groups(columns):
+        frame = meta["frames"][frame_id]
+        rows = rows[~np.asarray(columns["missing"][rows])]
+        if len(rows) == 0:
+            continue
+        width, height = _image_size(frame_dir, frame)
+        lines = [
+            f"{c} {x / width:.6f} {y / height:.6f} {box_size / width:.6f} {box_size / height:.6f}"
+            for c, x, y in zip(columns["cat"][rows], columns["x"][rows], columns["y"][rows])
+        ]
+        label_path = labels_dir / (frame + ".txt")
+        label_path.parent.mkdir(parents=True, exist_ok=True)
+        label_path.write_text("\n".join(lines) + "\n")
+
+
+def _retrieve_cmd_line_args():
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("out_dir", help="Folder where to write the export.")
+    parser.add_argument("--annot_dir", default=None, help="Parent folder of json annotations.")
+    parser.add_argument("--sqlite", default=None, help="SQLite annotation file to export instead of annot_dir.")
+    parser.add_argument("--cats", nargs="+", required=True, help="Exported categories, in order of their ids.")
+    parser.add_argument("--workers", type=int, default=4, help="Number of frame folders parsed in parallel.")
+    parser.add_argument("--npz", action="store_true", help="Bundle the columns into one npz file.")
+    parser.add_argument("--frame_dir", default=None, help="Parent frame folder, needed for --coco and --yolo.")
+    parser.add_argument("--coco", default=None, help="Also write COCO keypoints to this json file.")
+    parser.add_argument("--yolo", default=None, help="Also write YOLO labels to this folder.")
+    parser.add_argument("--yolo_box_size", type=float, default=20, help="Size of YOLO boxes in pixels.")
+    args = parser.parse_args()
+    if args.annot_dir is None and args.sqlite is None:
+        parser.error("One of --annot_dir and --sqlite is required.")
+    if (args.coco or args.yolo) and args.frame_dir is None:
+        parser.error("--frame_dir is required for --coco and --yolo.")
+    return args
+
+
+def _main():
+    args = _retrieve_cmd_line_args()
+    out_dir = Path(args.out_dir)
+    n_rows = export_columns(
+        out_dir, cats=args.cats,
+        annot_dir=Path(args.annot_dir) if args.annot_dir else None,
+        sqlite_path=Path(args.sqlite) if args.sqlite else None,
+        workers=args.workers, npz=args.npz
+    )
+    print(f"Exported {n_rows} rows to {out_dir}.")
+    if args.coco:
+        to_coco_keypoints(out_dir, Path(args.frame_dir), Path(args.coco))
+    if args.yolo:
+        to_yolo(out_dir, Path(args.frame_dir), Path(args.yolo), box_size=args.yolo_box_size)
+
+
+if __name__ == "__main__":
+    _main()
@@ -1,52 +1,369 @@
 from pathlib import Path
-import itertools as itt
+import collections
+import contextlib
+import functools
+import json
+import math
+import queue
+import re
+import subprocess
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
 import PIL.Image
-from typing import Tuple, Iterator
+from typing import Tuple, Iterator, Optional, List, Sequence, Callable
 
 from moviepy.video.io.VideoFileClip import VideoFileClip
 
 from piannot import data_dir
+from piannot.fileio import atomic_write_text
+from piannot.frame_filter import FrameFilter
+from piannot.extraction_manifest import ExtractionManifest, source_info
+from piannot.packed_frames import PackedFrameWriter, PACK_NAME, INDEX_NAME
 
 
-def video_frames(path: Path, t_start=0, t_end=None) -> Iterator[np.ndarray]:
-    """Video frames iterator that releases the resources correctly."""
+@contextlib.contextmanager
+def open_video(path: Path) -> Iterator[VideoFileClip]:
+    """Video clip context manager that releases the resources correctly."""
     clip = VideoFileClip(str(path))
     try:
-        subclip = clip.subclip(t_start=t_start, t_end=t_end)
-        yield from subclip.iter_frames()
+        yield clip
     finally:
         ## https://stackoverflow.com/questions/43966523/getting-oserror-winerror-6-the-handle-is-invalid-in-videofileclip-function
         clip.reader.close()
-        clip.audio.reader.close_proc()
+        if clip.audio is not None:
+            clip.audio.reader.close_proc()
+
+
+def count_frames(clip: VideoFileClip) -> int:
+    """Number of decodable frames; `clip.reader.nframes` counts one frame more than `iter_frames` yields."""
+    return min(clip.reader.nframes, int(round(clip.duration * clip.fps)))
+
+
+def video_frames(path: Path, t_start=0, t_end=None) -> Iterator[np.ndarray]:
+    """Video frames iterator that releases the resources correctly."""
+    with open_video(path) as clip:
+        subclip = clip.subclip(t_start=t_start, t_end=t_end)
+        yield from subclip.iter_frames()
+
+
+def frame_indices(n_frames: int, fps: float, step: int = 1, sample_fps: float = None,
+                  t_start: float = 0, t_end: float = None) -> np.ndarray:
+    """Indices of frames to extract from the time window `[t_start, t_end)`.
+
+    Either every frame whose index is divisible by `step`, or frames nearest
+    to a regular grid of `sample_fps` samples per second.
+    """
+    first = math.ceil(t_start * fps - 1e-6)
+    stop = n_frames if t_end is None else min(n_frames, math.ceil(t_end * fps - 1e-6))
+    if sample_fps:
+        times = np.arange(first / fps, stop / fps, 1 / sample_fps)
+        indices = np.unique(np.round(times * fps).astype(int))
+        return indices[(indices >= first) & (indices < stop)]
+    first = step * math.ceil(first / step)
+    return np.arange(first, stop, step)
+
+
+def keyframe_indices(path: Path, fps: float) -> np.ndarray:
+    """Indices of the key frames, found by decoding only the key frames with ffmpeg."""
+    from imageio_ffmpeg import get_ffmpeg_exe
+    cmd = [get_ffmpeg_exe(), "-hide_banner", "-skip_frame", "nokey", "-i", str(path),
+           "-an", "-vf", "showinfo", "-vsync", "0", "-f", "null", "-"]
+    stderr = subprocess.run(cmd, stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, check=True).stderr
+    times = [float(t) for t in re.findall(rb"pts_time:\s*([-\d.]+)", stderr)]
+    return np.unique(np.round(np.array(times) * fps).astype(int))
+
+
+def sequential_frames(path: Path, indices: Sequence[int]) -> Iterator[Tuple[int, np.ndarray]]:
+    """Decode all frames from the first to the last index and yield the requested ones."""
+    if len(indices) == 0:
+        return
+    wanted = set(int(i) for i in indices)
+    with open_video(path) as clip:
+        first, last = min(wanted), max(wanted)
+        for i, frame in enumerate(clip.subclip(t_start=first / clip.fps).iter_frames(), start=first):
+            if i in wanted:
+                yield i, frame
+            if i >= last:
+                break
+
+
+def seek_frames(path: Path, indices: Sequence[int]) -> Iterator[Tuple[int, np.ndarray]]:
+    """Fetch only the frames with given indices.
+
+    The reader seeks to frames far ahead and skips the undecoded bytes of
+    frames near ahead, instead of converting every frame to an array.
+    """
+    with open_video(path) as clip:
+        n_frames = count_frames(clip)
+        for i in indices:
+            if i >= n_frames:
+                # Seeking past the end would repeat the last frame.
+                break
+            yield int(i), clip.get_frame(i / clip.fps)
+
+
+def _frame_folder(i: int, out_folder: Path, divide: Optional[int]) -> Path:
+    if not divide:
+        return out_folder
+    start_i = divide * (i // divide)
+    end_i = start_i + divide - 1
+    return out_folder / f"frames_{start_i:0>5d}-{end_i:0>5d}"
+
+
+def _frame_name(i: int) -> str:
+    return f"frame_{i:0>5d}.jpg"
 
 
 def _save_frame(i: int, frame: np.array, out_folder: Path) -> None:
     out_folder.mkdir(parents=True, exist_ok=True)
-    out_path = out_folder / f"frame_{i:0>5d}.jpg"
+    out_path = out_folder / _frame_name(i)
     img = PIL.Image.fromarray(frame)
     img.save(out_path)
 
 
-def extract_frames_from_one_video(video_path: Path, out_folder: Path, step: int = 1, divide: int = None):
-    print(f"Extracting frames from {video_path} to {out_folder}.")
+def save_frames(frames: Iterator[Tuple[int, np.ndarray]], out_folder: Path, divide: int = None,
+                workers: int = 1, checkpoint: Callable[[int], None] = None, checkpoint_every: int = 100,
+                save: Callable[[int, np.ndarray], None] = None) -> int:
+    """Save `(i, frame)` pairs as jpgs using `workers` encoding threads. Returns number of saved frames.
 
-    fr = enumerate(video_frames(video_path))
-    fr = itt.islice(fr, None, None, step)
+    A different way of saving a frame can be given by `save(i, frame)`.
 
-    if not divide:
-        for i, frame in fr:
-            _save_frame(i, frame, out_folder=out_folder)
+    The frames are decoded on the calling thread and passed to the encoders
+    through a bounded queue, so decoding and encoding run concurrently while
+    only a few decoded frames are held in memory.
+
+    Every `checkpoint_every` frames `checkpoint(i)` is called with the largest
+    index `i` such that all frames up to `i` have been written.
+    """
+    if workers < 1:
+        raise ValueError(f"At least one encoding worker is needed, got workers={workers}.")
+    frame_queue = queue.Queue(maxsize=2 * workers)
+    errors = []
+    in_flight = collections.deque()
+    written = set()
+    lock = threading.Lock()
+
+    def encode():
+        while True:
+            item = frame_queue.get()
+            if item is None:
+                return
+            i, frame = item
+            try:
+                if save is None:
+                    _save_frame(i, frame, out_folder=_frame_folder(i, out_folder, divide))
+                else:
+                    save(i, frame)
+            except Exception as exc:
+                errors.append(exc)
+            else:
+                with lock:
+                    written.add(i)
+
+    def written_up_to() -> Optional[int]:
+        last = None
+        with lock:
+            while in_flight and in_flight[0] in written:
+                last = in_flight.popleft()
+                written.discard(last)
+        return last
+
+    threads = [threading.Thread(target=encode, daemon=True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+
+    count = 0
+    try:
+        for i, frame in frames:
+            if errors:
+                break
+            with lock:
+                in_flight.append(i)
+            frame_queue.put((i, frame))
+            count += 1
+            if checkpoint is not None and count % checkpoint_every == 0:
+                last = written_up_to()
+                if last is not None:
+                    checkpoint(last)
+    finally:
+        for _ in threads:
+            frame_queue.put(None)
+        for thread in threads:
+            thread.join()
+
+    if errors:
+        raise errors[0]
+    return count
+
+
+class _PackedFrameSaver:
+    """Saves frames into packs, one per (divided) frame folder."""
+
+    def __init__(self, out_folder: Path, divide: Optional[int], reduce: int):
+        self.out_folder, self.divide, self.reduce = out_folder, divide, reduce
+        self._writers = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, i: int, frame: np.ndarray):
+        folder = _frame_folder(i, self.out_folder, self.divide)
+        with self._lock:
+            if folder not in self._writers:
+                self._writers[folder] = PackedFrameWriter(folder, reduce=self.reduce)
+            writer = self._writers[folder]
+        writer.add(_frame_name(i)[:-len(".jpg")], frame)
+
+    def flush(self):
+        with self._lock:
+            for writer in self._writers.values():
+                writer.flush()
+
+    def close(self):
+        with self._lock:
+            for writer in self._writers.values():
+                writer.close()
+
+
+_DIVIDED_FOLDER = re.compile(r"frames_\d{5,}-\d{5,}")
+
+
+def _remove_extracted_frames(out_folder: Path):
+    """Remove frames of `out_folder` and of its `divide` subfolders, but not of nested videos' folders."""
+    folders = [out_folder] + [
+        path for path in out_folder.glob("frames_*-*") if path.is_dir() and _DIVIDED_FOLDER.fullmatch(path.name)
+    ]
+    for folder in folders:
+        for pattern in ["frame_*.jpg", PACK_NAME, INDEX_NAME]:
+            for path in folder.glob(pattern):
+                path.unlink()
+        if folder != out_folder and not any(folder.iterdir()):
+            folder.rmdir()
+    kept_path = out_folder / "kept_frames.json"
+    if kept_path.exists():
+        kept_path.unlink()
+
+
+def extract_frames_from_one_video(video_path: Path, out_folder: Path, step: int = 1, divide: int = None,
+                                  workers: int = 1, sampling: str = "auto", sample_fps: float = None,
+                                  keyframes: bool = False, t_start: float = 0, t_end: float = None,
+                                  frame_filter: FrameFilter = None, resume: bool = True,
+                                  packed: bool = False, packed_reduce: int = 1) -> int:
+    """Save selected frames of the video. Returns number of saved frames.
+
+    Frames are selected by `step`, by `sample_fps` or as the key frames
+    (`keyframes`), within the time window `[t_start, t_end)`. Every frame is
+    named by its index in the whole video. `sampling` is "sequential" (decode
+    every frame of the window), "seek" (fetch only the selected frames) or
+    "auto" (seek unless every frame is selected).
+
+    With `frame_filter` near-duplicate frames are dropped and the kept frames
+    with their indices are listed in `kept_frames.json` in `out_folder`.
+
+    Progress is recorded in an `ExtractionManifest` in `out_folder`. With
+    `resume`, a video already extracted with the same parameters is skipped
+    and a partial extraction continues after the last written frame. If the
+    video or the parameters have changed, the old frames are removed first.
+
+    With `packed` the frames of each folder are stored in one `frames.pack`
+    file (see `packed_frames`), scaled down `packed_reduce` times, instead of jpgs.
+    """
+    source = source_info(video_path)
+    params = {
+        "step": step, "divide": divide, "sample_fps": sample_fps, "keyframes": keyframes,
+        "t_start": t_start, "t_end": t_end, "packed": packed, "packed_reduce": packed_reduce,
+        "filter": None if frame_filter is None else [frame_filter.mode, frame_filter.threshold, frame_filter.use_mse],
+    }
+    manifest = ExtractionManifest.load(out_folder)
+    if not resume or manifest is None or not manifest.matches(source, params):
+        if manifest is not None:
+            print(f"Source or parameters of {video_path} have changed, removing frames in {out_folder}.")
+            _remove_extracted_frames(out_folder)
+        manifest = ExtractionManifest(out_folder, source, params)
+    elif manifest.complete:
+        print(f"Skipping {video_path}, its frames have already been extracted.")
+        return 0
+
+    print(f"Extracting frames from {video_path} to {out_folder}"
+          + ("." if manifest.last_index is None else f", resuming after frame {manifest.last_index}."))
+
+    with open_video(video_path) as clip:
+        fps, n_frames = clip.fps, count_frames(clip)
+
+    if keyframes:
+        indices = keyframe_indices(video_path, fps)
+        stop = n_frames if t_end is None else t_end * fps
+        indices = indices[(indices >= t_start * fps) & (indices < stop)]
     else:
-        for i, frame in fr:
-            start_i = divide * (i // divide)
-            end_i = start_i + divide - 1
-            sub_folder = f"frames_{start_i:0>5d}-{end_i:0>5d}"
-            _save_frame(i, frame, out_folder=out_folder / sub_folder)
+        indices = frame_indices(n_frames, fps, step=step, sample_fps=sample_fps, t_start=t_start, t_end=t_end)
+
+    if manifest.last_index is not None:
+        indices = indices[indices > manifest.last_index]
+
+    if sampling == "auto":
+        sampling = "seek" if len(indices) > 1 and np.any(np.diff(indices) > 1) else "sequential"
+    fr = seek_frames(video_path, indices) if sampling == "seek" else sequential_frames(video_path, indices)
+    if frame_filter is not None:
+        frame_filter.kept = []
+        fr = frame_filter(fr)
+
+    saver = _PackedFrameSaver(out_folder, divide, packed_reduce) if packed else None
+
+    def checkpoint(last_index: int):
+        if saver is not None:
+            saver.flush()
+        manifest.last_index = last_index
+        manifest.save()
+
+    manifest.save()
+    previously_kept = _load_kept_frames(out_folder) if frame_filter is not None else []
+    try:
+        count = save_frames(fr, out_folder=out_folder, divide=divide, workers=workers, checkpoint=checkpoint,
+                            save=saver)
+    finally:
+        if saver is not None:
+            saver.close()
+
+    if frame_filter is not None:
+        print(f"Kept {len(frame_filter.kept)} of {len(indices)} frames of {video_path}.")
+        _save_filter_manifest(frame_filter, out_folder, divide, previously_kept)
+    if len(indices):
+        manifest.last_index = int(indices[-1])
+    manifest.complete = True
+    manifest.save()
+    return count
 
 
-def _retrieve_cmd_line_args() -> Tuple[Path, Path, int, int]:
+def _load_kept_frames(out_folder: Path) -> List[dict]:
+    try:
+        with open(out_folder / "kept_frames.json", "rt") as file:
+            return json.load(file)["frames"]
+    except FileNotFoundError:
+        return []
+
+
+def _save_filter_manifest(frame_filter: FrameFilter, out_folder: Path, divide: Optional[int],
+                          previously_kept: List[dict] = ()):
+    first_new = frame_filter.kept[0][0] if frame_filter.kept else np.inf
+    manifest = {
+        "mode": frame_filter.mode,
+        "metric": "mse" if frame_filter.use_mse else "dhash",
+        "threshold": frame_filter.threshold,
+        "frames": [f for f in previously_kept if f["index"] < first_new] + [
+            {
+                "path": (_frame_folder(i, out_folder, divide) / _frame_name(i)).relative_to(out_folder).as_posix(),
+                "index": i,
+                "distance": None if np.isinf(d) else d
+            }
+            for i, d in frame_filter.kept
+        ]
+    }
+    out_folder.mkdir(parents=True, exist_ok=True)
+    atomic_write_text(str(out_folder / "kept_frames.json"), json.dumps(manifest, indent=1))
+
+
+def _retrieve_cmd_line_args():
     import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument("--video_folder", default=None, help="folder containig input videos")
@@ -55,24 +372,69 @@ def _retrieve_cmd_line_args() -> Tuple[Path, Path, int, int]:
                         help="We save frame with index i iff i is divisible by step. Defaults to 1.",
                         default=1
                         )
+    parser.add_argument("--fps", type=float, default=None,
+                        help="Save frames nearest to this many samples per second instead of using step.")
+    parser.add_argument("--keyframes", action="store_true", help="Save only the key frames of the videos.")
+    parser.add_argument("--t_start", type=float, default=0, help="Start of the extracted window in seconds.")
+    parser.add_argument("--t_end", type=float, default=None, help="End of the extracted window in seconds.")
+    parser.add_argument("--sampling", choices=["auto", "sequential", "seek"], default="auto",
+                        help="Decode every frame or seek to the selected ones. Defaults to seeking when "
+                             "frames are skipped.")
+    parser.add_argument("--filter", choices=["dedupe", "scenes"], default=None,
+                        help="Drop frames similar to the last kept one, or keep only scene changes.")
+    parser.add_argument("--filter_threshold", type=float, default=4,
+                        help="Frames further than this from the reference are kept. Hamming distance of "
+                             "64 bit difference hashes, or mean squared error with --filter_mse. Defaults to 4.")
+    parser.add_argument("--filter_mse", action="store_true",
+                        help="Compare 32x32 gray thumbnails by mean squared error instead of hashes.")
+    parser.add_argument("--packed", action="store_true",
+                        help="Store the frames of each folder in one memory-mappable pack file instead of jpgs.")
+    parser.add_argument("--packed_reduce", type=int, default=1,
+                        help="Scale the packed frames down this many times. Defaults to 1.")
     parser.add_argument("--divide", type=int,
                         help="We divide the frames into folders with specified number of frames.",
                         default=None
                         )
+    parser.add_argument("--force", action="store_true",
+                        help="Extract all videos again instead of skipping or resuming already extracted ones.")
+    parser.add_argument("--workers", type=int, default=2,
+                        help="Number of threads encoding and writing frames of each video. Defaults to 2.")
+    parser.add_argument("--parallel_videos", type=int, default=1,
+                        help="Number of videos processed in parallel processes. Defaults to 1.")
     args = parser.parse_args()
+    if args.workers < 1:
+        parser.error("--workers must be at least 1.")
 
-    video_folder = Path(args.video_folder or data_dir / "videos")
-    parent_frame_folder = Path(args.parent_frame_folder or data_dir / "frames")
+    args.video_folder = Path(args.video_folder or data_dir / "videos")
+    args.parent_frame_folder = Path(args.parent_frame_folder or data_dir / "frames")
 
-    return video_folder, parent_frame_folder, args.step, args.divide
+    return args
 
 
 def _main():
-    video_folder, parent_frame_folder, step, divide = _retrieve_cmd_line_args()
+    args = _retrieve_cmd_line_args()
+    video_folder, parent_frame_folder = args.video_folder, args.parent_frame_folder
+
+    extract = functools.partial(
+        extract_frames_from_one_video, step=args.step, divide=args.divide, workers=args.workers,
+        sampling=args.sampling, sample_fps=args.fps, keyframes=args.keyframes,
+        t_start=args.t_start, t_end=args.t_end,
+        frame_filter=FrameFilter(args.filter, args.filter_threshold, args.filter_mse) if args.filter else None,
+        resume=not args.force, packed=args.packed, packed_reduce=args.packed_reduce
+    )
+    video_paths = list(video_folder.glob("**/*.mp4"))
+    out_folders = [parent_frame_folder / p.relative_to(video_folder).with_suffix("") for p in video_paths]
+
+    start = time.perf_counter()
+    if args.parallel_videos > 1 and video_paths:
+        with ProcessPoolExecutor(max_workers=args.parallel_videos) as executor:
+            n_frames = sum(executor.map(extract, video_paths, out_folders))
+    else:
+        n_frames = sum(map(extract, video_paths, out_folders))
+    elapsed = time.perf_counter() - start
 
-    for video_path in video_folder.glob("**/*.mp4"):
-        out_folder = parent_frame_folder / video_path.relative_to(video_folder).with_suffix("")
-        extract_frames_from_one_video(video_path, out_folder, step, divide)
+    print(f"Extracted {n_frames} frames from {len(video_paths)} videos in {elapsed:.1f} s "
+          f"({n_frames / max(elapsed, 1e-9):.1f} frames/s).")
 
 
 if __name__ == "__main__":
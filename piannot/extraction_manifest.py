@@ -0,0 +1,72 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Optional
+
+from piannot.fileio import atomic_write_text
+
+MANIFEST_NAME = "extraction.json"
+
+
+def source_info(video_path: Path, chunk_size: int = 2**20) -> dict:
+    """Size, mtime and a quick hash (of the size and the first and last `chunk_size` bytes) of a video."""
+    stat = os.stat(video_path)
+    digest = hashlib.sha1(str(stat.st_size).encode())
+    with open(video_path, "rb") as file:
+        digest.update(file.read(chunk_size))
+        if stat.st_size > chunk_size:
+            file.seek(max(chunk_size, stat.st_size - chunk_size))
+            digest.update(file.read(chunk_size))
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "hash": digest.hexdigest()}
+
+
+class ExtractionManifest:
+    """Record of frames extracted from one video into `out_folder`.
+
+    It stores the source video info, the extraction parameters and the index
+    of the last frame such that all frames up to it have been written.
+    """
+    out_folder: Path
+    source: dict
+    params: dict
+    last_index: Optional[int]
+    complete: bool
+
+    def __init__(self, out_folder: Path, source: dict, params: dict,
+                 last_index: int = None, complete: bool = False):
+        self.out_folder = out_folder
+        self.source = source
+        self.params = params
+        self.last_index = last_index
+        self.complete = complete
+
+    @property
+    def path(self) -> Path:
+        return self.out_folder / MANIFEST_NAME
+
+    @staticmethod
+    def load(out_folder: Path) -> Optional["ExtractionManifest"]:
+        try:
+            with open(out_folder / MANIFEST_NAME, "rt") as file:
+                dic = json.load(file)
+        except (FileNotFoundError, ValueError):
+            return None
+        return ExtractionManifest(out_folder, **dic)
+
+    def save(self):
+        self.out_folder.mkdir(parents=True, exist_ok=True)
+        dic = {
+            "source": self.source,
+            "params": self.params,
+            "last_index": self.last_index,
+            "complete": self.complete,
+        }
+        atomic_write_text(str(self.path), json.dumps(dic, indent=1))
+
+    def matches(self, source: dict, params: dict) -> bool:
+        # The mtime alone may change by copying, so only a changed hash or size counts.
+        return (
+            self.source["size"] == source["size"] and self.source["hash"] == source["hash"]
+            and self.params == params
+        )
@@ -0,0 +1,32 @@
+import os
+import uuid
+
+
+def atomic_write_bytes(path: str, data: bytes, fsync: bool = False):
+    """Write `data` to `path` so that readers see either the old or the new content.
+
+    The data are written to a temporary file in the same folder which then
+    replaces `path`. With `fsync` the data are flushed to the disk before the
+    replacement.
+    """
+    folder, name = os.path.split(os.path.abspath(path))
+    tmp_path = os.path.join(folder, f".{name}.{uuid.uuid4().hex}.tmp")
+    # Unlike `tempfile.mkstemp`, this respects umask for the permissions of the new file.
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0), 0o666)
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.write(data)
+            if fsync:
+                file.flush()
+                os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def atomic_write_text(path: str, text: str, fsync: bool = False):
+    atomic_write_bytes(path, text.encode("utf-8"), fsync=fsync)
@@ -0,0 +1,197 @@
+"""Persisted index of frame folders with their frame and annotation counts."""
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Callable
+
+import numpy as np
+
+from piannot.annotation_database import AnnotationDatabase, SqliteAnnotationDatabase, UNSPECIFIED
+from piannot.fileio import atomic_write_text
+from piannot.image_database import natural_sort_key
+from piannot.packed_frames import INDEX_NAME, _read_index
+
+import logging
+logger = logging.getLogger()
+
+# Not a `.json` file, so that scans of json annotations skip it.
+FOLDER_INDEX_NAME = ".folder_index"
+
+
+def _mtime_ns(path: Path) -> Optional[int]:
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _scan_dir(path: Path) -> dict:
+    """Subfolders and number of frames of one folder."""
+    subdirs, n_frames = [], 0
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_dir():
+                subdirs.append(entry.name)
+            elif os.path.splitext(entry.name)[1] == ".jpg":
+                n_frames += 1
+    if n_frames == 0 and (path / INDEX_NAME).exists():
+        n_frames = len(_read_index(path)["slots"])
+    return {"subdirs": sorted(subdirs, key=natural_sort_key), "n_frames": n_frames}
+
+
+def find_first_frame_dir(parent_frame_dir: Path) -> Optional[Path]:
+    """First folder (in natural order, depth first) containing jpg frames or a frame pack."""
+    info = _scan_dir(parent_frame_dir)
+    if info["n_frames"]:
+        return parent_frame_dir
+    for name in info["subdirs"]:
+        found = find_first_frame_dir(parent_frame_dir / name)
+        if found is not None:
+            return found
+    return None
+
+
+class FolderIndex:
+    """Frame folders of `parent_frame_dir` with frame counts and per-category annotation counts.
+
+    The index is kept in `parent_annot_dir/.folder_index`. It is updated
+    incrementally: a folder is listed again only if its mtime has changed, and
+    its annotations are counted again only if the mtime of its annotation folder
+    (or of the SQLite file) has changed. Reading the index never touches the disk.
+    """
+    parent_frame_dir: Path
+    parent_annot_dir: Path
+    cats: List[str]
+    sqlite_path: Optional[Path]
+    _dirs: Dict[str, dict]
+
+    def __init__(self, parent_frame_dir: Path, parent_annot_dir: Path, cats: List[str],
+                 sqlite_path: Path = None):
+        self.parent_frame_dir = parent_frame_dir
+        self.parent_annot_dir = parent_annot_dir
+        self.cats = cats
+        self.sqlite_path = sqlite_path
+        self._lock = threading.Lock()
+        self._thread = None
+        self._listeners = []
+        self._dirs = self._load()
+
+    @property
+    def path(self) -> Path:
+        return self.parent_annot_dir / FOLDER_INDEX_NAME
+
+    def _load(self) -> Dict[str, dict]:
+        try:
+            with open(self.path, "rt") as file:
+                dic = json.load(file)
+        except (FileNotFoundError, ValueError):
+            return {}
+        return dic["dirs"] if dic.get("cats") == self.cats else {}
+
+    def _save(self):
+        self.parent_annot_dir.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            text = json.dumps({"cats": self.cats, "dirs": self._dirs})
+        atomic_write_text(str(self.path), text)
+
+    def _annotations_mtime(self, folder: str) -> Optional[int]:
+        if self.sqlite_path is not None:
+            mtimes = [_mtime_ns(self.sqlite_path), _mtime_ns(Path(f"{self.sqlite_path}-wal"))]
+            return max((m for m in mtimes if m is not None), default=None)
+        return _mtime_ns(self.parent_annot_dir / folder)
+
+    def _count_annotations(self, folder: str) -> Dict[str, int]:
+        """Number of frames of `folder` with specified (annotated or missing) status of each category."""
+        if self.sqlite_path is not None:
+            db = SqliteAnnotationDatabase(self.sqlite_path, folder=folder)
+        else:
+            db = AnnotationDatabase(str(self.parent_annot_dir / folder), read_only=True)
+        try:
+            keys = db.keys()
+            return {cat: int(np.count_nonzero(db.get_status_array(cat, keys) != UNSPECIFIED)) for cat in self.cats}
+        finally:
+            db.close()
+
+    def _update_dir(self, folder: str, old_dirs: Dict[str, dict], new_dirs: Dict[str, dict]):
+        path = self.parent_frame_dir / folder
+        mtime = _mtime_ns(path)
+        if mtime is None:
+            return
+        entry = old_dirs.get(folder)
+        if entry is None or entry["mtime_ns"] != mtime:
+            entry = {"mtime_ns": mtime, **_scan_dir(path), "annot_mtime_ns": None, "annotated": {}}
+        else:
+            entry = dict(entry)
+        if entry["n_frames"]:
+            annot_mtime = self._annotations_mtime(folder)
+            if annot_mtime is None:
+                entry["annot_mtime_ns"], entry["annotated"] = None, {}
+            elif annot_mtime != entry["annot_mtime_ns"]:
+                entry["annot_mtime_ns"], entry["annotated"] = annot_mtime, self._count_annotations(folder)
+        new_dirs[folder] = entry
+        for name in entry["subdirs"]:
+            self._update_dir(f"{folder}/{name}" if folder else name, old_dirs, new_dirs)
+
+    def refresh(self):
+        """Bring the index up to date with the disk and save it."""
+        with self._lock:
+            old_dirs = dict(self._dirs)
+        new_dirs = {}
+        self._update_dir("", old_dirs, new_dirs)
+        with self._lock:
+            self._dirs = new_dirs
+        self._save()
+        for listener in self._listeners:
+            listener()
+
+    def refresh_in_background(self):
+        """Start `refresh` on a daemon thread unless one is already running."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._refresh_logged, daemon=True)
+        self._thread.start()
+
+    def _refresh_logged(self):
+        try:
+            self.refresh()
+        except Exception:
+            logger.exception("Refreshing the folder index failed.")
+
+    def wait(self):
+        """Wait for a background refresh to finish."""
+        if self._thread is not None:
+            self._thread.join()
+
+    def add_listener(self, listener: Callable[[], None]):
+        """Call `listener()` (from the refreshing thread) after each refresh."""
+        self._listeners.append(listener)
+
+    def update_annotated(self, folder: str, annotated: Dict[str, int]):
+        """Set annotation counts of `folder` known by the caller, e.g. from an open annotation database."""
+        with self._lock:
+            if folder in self._dirs:
+                self._dirs[folder] = {**self._dirs[folder], "annotated": annotated}
+
+    def frame_folders(self) -> List[str]:
+        """Folders (relative to `parent_frame_dir`) containing frames, in natural order."""
+        with self._lock:
+            folders = [folder for folder, entry in self._dirs.items() if entry["n_frames"]]
+        return sorted(folders, key=natural_sort_key)
+
+    def n_frames(self, folder: str) -> int:
+        with self._lock:
+            return self._dirs[folder]["n_frames"]
+
+    def annotated(self, folder: str) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._dirs[folder]["annotated"])
+
+    def completion(self, folder: str) -> float:
+        """Fraction of frame-category pairs of `folder` with specified status."""
+        with self._lock:
+            entry = self._dirs[folder]
+        if not entry["n_frames"] or not self.cats:
+            return 0.
+        n_done = sum(min(entry["annotated"].get(cat, 0), entry["n_frames"]) for cat in self.cats)
+        return n_done / (entry["n_frames"] * len(self.cats))
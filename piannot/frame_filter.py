@@ -0,0 +1,88 @@
+"""Dropping of near-duplicate and static frames during frame extraction."""
+from typing import Iterator, Tuple, List, Optional
+
+import numpy as np
+import PIL.Image
+
+
+def shrink(frame: np.ndarray, min_side: int = 128) -> np.ndarray:
+    """Gray float image of `frame` reduced by an integer factor, keeping at least `min_side` pixels per side.
+
+    The block averaging is done by PIL on the uint8 frame, so no full-resolution float copy is made.
+    """
+    factor = max(min(frame.shape[:2]) // min_side, 1)
+    image = PIL.Image.fromarray(frame)
+    if factor > 1:
+        image = image.reduce(factor)
+    small = np.asarray(image, dtype=np.float32)
+    return small.mean(axis=-1) if small.ndim == 3 else small
+
+
+def thumbnails(frames: np.ndarray, size: Tuple[int, int]) -> np.ndarray:
+    """Gray thumbnails of shape `(n,) + size` by averaging blocks of a `(n, h, w, 3)` batch."""
+    h, w = frames.shape[1:3]
+    gray = frames.mean(axis=-1, dtype=np.float32) if frames.ndim == 4 else frames.astype(np.float32)
+    rows = np.linspace(0, h, size[0] + 1).astype(int)[:-1]
+    cols = np.linspace(0, w, size[1] + 1).astype(int)[:-1]
+    sums = np.add.reduceat(np.add.reduceat(gray, rows, axis=1), cols, axis=2)
+    counts = np.diff(np.append(rows, h))[:, None] * np.diff(np.append(cols, w))[None, :]
+    return sums / counts
+
+
+def difference_hashes(frames: np.ndarray, hash_size: int = 8) -> np.ndarray:
+    """Difference hashes of a `(n, h, w, 3)` batch as `(n, hash_size**2 // 8)` uint8 arrays."""
+    thumbs = thumbnails(frames, (hash_size, hash_size + 1))
+    bits = thumbs[:, :, 1:] > thumbs[:, :, :-1]
+    return np.packbits(bits.reshape(len(frames), -1), axis=1)
+
+
+def hamming_distances(hashes: np.ndarray, reference: np.ndarray) -> np.ndarray:
+    return np.unpackbits(hashes ^ reference, axis=-1).sum(axis=-1)
+
+
+class FrameFilter:
+    """Filters a stream of `(i, frame)` pairs.
+
+    In mode "dedupe" a frame is dropped if it is within `threshold` of the last
+    kept frame; in mode "scenes" only frames differing by more than
+    `threshold` from the previous frame (scene changes) and the first frame are
+    kept. The distance is the Hamming distance of difference hashes, or the mean
+    squared error of 32x32 gray thumbnails if `use_mse`.
+
+    Each frame is shrunk as it arrives and decided on at once, so only the
+    small signatures are held and frames are passed on without buffering.
+    `kept` records `(i, distance)` of the kept frames, the distance of the
+    first frame is inf.
+    """
+    kept: List[Tuple[int, float]]
+
+    def __init__(self, mode: str = "dedupe", threshold: float = 4, use_mse: bool = False):
+        assert mode in {"dedupe", "scenes"}, mode
+        self.mode = mode
+        self.threshold = threshold
+        self.use_mse = use_mse
+        self.kept = []
+
+    def signature(self, frame: np.ndarray) -> np.ndarray:
+        small = shrink(frame)[None]
+        if self.use_mse:
+            return thumbnails(small, (32, 32))[0]
+        return difference_hashes(small)[0]
+
+    def _distance(self, signature: np.ndarray, reference: np.ndarray) -> float:
+        if self.use_mse:
+            return float(((signature - reference) ** 2).mean())
+        return float(hamming_distances(signature, reference))
+
+    def __call__(self, frames: Iterator[Tuple[int, np.ndarray]]) -> Iterator[Tuple[int, np.ndarray]]:
+        # The last kept frame in mode "dedupe", the previous frame in mode "scenes".
+        reference: Optional[np.ndarray] = None
+        for i, frame in frames:
+            signature = self.signature(frame)
+            d = np.inf if reference is None else self._distance(signature, reference)
+            keep = d > self.threshold
+            if keep or self.mode == "scenes":
+                reference = signature
+            if keep:
+                self.kept.append((i, float(d)))
+                yield i, frame
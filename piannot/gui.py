@@ -1,18 +1,28 @@
+import contextlib
+import time
 from pathlib import Path
+from typing import Tuple, List
+
+import numpy as np
 
 import PyQt5.QtWidgets as qtw
-from PyQt5.QtCore import pyqtSignal, Qt
+from PyQt5.QtCore import pyqtSignal, Qt, QTimer, QAbstractListModel, QModelIndex
 from PyQt5 import QtGui
 from PyQt5.QtWidgets import QFileDialog, QMessageBox
 
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 
 from piannot.annotator import Annotator
+from piannot.annotation_database import UNSPECIFIED
 
 import logging
 
 from piannot.annotator_selector import AnnotatorSelector
+from piannot.folder_index import FolderIndex
+from piannot.packed_frames import is_packed_dir
+from piannot.timing import timings
+from piannot.write_behind import WriteError
 
 logger = logging.getLogger()
 
@@ -26,15 +36,15 @@ def _choose_frame_dir(parent: qtw.QWidget, home_dir: Path, current_dir: Path) ->
         if not frame_dir:  # selection has been cancelled
             return current_dir
         frame_dir = Path(frame_dir)
-        logger.debug(f"Selected directory: {frame_dir}")
+        logger.debug("Selected directory: %s", frame_dir)
         if home_dir not in frame_dir.parents:
             QMessageBox.warning(parent, "Wrong directory", f"The chosen directory is not subdirectory of {home_dir}.")
-            logger.debug(f"The chosen directory is not subdirectory of {home_dir}.")
+            logger.debug("The chosen directory is not subdirectory of %s.", home_dir)
             continue
 
-        if not any(frame_dir.glob("*.jpg")):
-            QMessageBox.warning(parent, "Wrong directory", "The chosen directory does not contain any jpg files.")
-            logger.debug("The chosen directory does not contain any jpg files.")
+        if not any(frame_dir.glob("*.jpg")) and not is_packed_dir(frame_dir):
+            QMessageBox.warning(parent, "Wrong directory", "The chosen directory does not contain any frames.")
+            logger.debug("The chosen directory does not contain any frames.")
             continue
 
         break
@@ -42,6 +52,49 @@ def _choose_frame_dir(parent: qtw.QWidget, home_dir: Path, current_dir: Path) ->
     return frame_dir
 
 
+class FolderDialog(qtw.QDialog):
+    """Picker of frame folders showing their completion from a `FolderIndex`, without touching the disk."""
+
+    def __init__(self, parent: qtw.QWidget, folder_index: FolderIndex, current_dir: Path):
+        super().__init__(parent)
+        self.folder_index = folder_index
+        self.frame_dir = current_dir
+        self.setWindowTitle("Select folder")
+
+        self._list = qtw.QListWidget()
+        for folder in folder_index.frame_folders():
+            item = qtw.QListWidgetItem(
+                f"{folder or '.'}    {folder_index.n_frames(folder)} frames, {folder_index.completion(folder):.0%} done")
+            item.setData(Qt.UserRole, folder)
+            self._list.addItem(item)
+            if folder_index.parent_frame_dir / folder == current_dir:
+                self._list.setCurrentItem(item)
+        self._list.itemDoubleClicked.connect(self.accept)
+
+        buttons = qtw.QDialogButtonBox(qtw.QDialogButtonBox.Ok | qtw.QDialogButtonBox.Cancel)
+        browse_button = buttons.addButton("Browse...", qtw.QDialogButtonBox.ActionRole)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+        browse_button.clicked.connect(self._browse)
+
+        layout = qtw.QVBoxLayout()
+        layout.addWidget(self._list)
+        layout.addWidget(buttons)
+        self.setLayout(layout)
+        self.resize(600, 400)
+
+    def accept(self):
+        item = self._list.currentItem()
+        if item is not None:
+            self.frame_dir = self.folder_index.parent_frame_dir / item.data(Qt.UserRole)
+        super().accept()
+
+    def _browse(self):
+        self.frame_dir = _choose_frame_dir(parent=self, home_dir=self.folder_index.parent_frame_dir,
+                                           current_dir=self.frame_dir)
+        super().accept()
+
+
 class MainWindow(qtw.QMainWindow):
     def __init__(self, annotator_selector: AnnotatorSelector):
         super().__init__()
@@ -52,14 +105,38 @@ class MainWindow(qtw.QMainWindow):
         self.statusBar().showMessage(
             f"{self.annotator_selector.frame_dir.relative_to(self.annotator_selector.parent_frame_dir)}")
 
+    def show_timings(self, state: bool):
+        """Show p50/p95/p99 latencies of the timing spans in the status bar, updated every second."""
+        self._timings_label.setVisible(state)
+        if state:
+            self._update_timings_label()
+            self._timings_timer.start()
+        else:
+            self._timings_timer.stop()
+
+    def _update_timings_label(self):
+        self._timings_label.setText(timings.overlay_text())
+
     def change_folder(self):
-        logging.debug("Change folder invoked.")
-        new_frame_dir = _choose_frame_dir(parent=self, home_dir=self.annotator_selector.parent_frame_dir,
-                                          current_dir=self.annotator_selector.frame_dir)
-        logging.debug(f"new_frame_dir: {new_frame_dir}")
+        logger.debug("Change folder invoked.")
+        folder_index = self.annotator_selector.folder_index
+        folder_index.update_annotated(self.annotator_selector.folder, self.main_widget.annotator.count_annotated())
+        dialog = FolderDialog(parent=self, folder_index=folder_index, current_dir=self.annotator_selector.frame_dir)
+        if not dialog.exec_():
+            return
+        new_frame_dir = dialog.frame_dir
+        logger.debug("new_frame_dir: %s", new_frame_dir)
+        if new_frame_dir == self.annotator_selector.frame_dir:
+            return
         self.annotator_selector.frame_dir = new_frame_dir
         self.main_widget.reset_annotator(self.annotator_selector.get_annotator())
         self._reset_status_bar()
+        folder_index.refresh_in_background()
+
+    def closeEvent(self, event):
+        with self.main_widget.reporting_write_errors():
+            self.main_widget.annotator.close()
+        super().closeEvent(event)
 
     def _initUI(self):
         self.main_widget = MainWidget(annotator=self.annotator_selector.get_annotator())
@@ -70,6 +147,13 @@ class MainWindow(qtw.QMainWindow):
 
         self._reset_status_bar()
 
+        self._timings_label = qtw.QLabel()
+        self._timings_label.setVisible(False)
+        self.statusBar().addPermanentWidget(self._timings_label)
+        self._timings_timer = QTimer(self)
+        self._timings_timer.setInterval(1000)
+        self._timings_timer.timeout.connect(self._update_timings_label)
+
         change_folder_action = qtw.QAction("folder", self)
         change_folder_action.triggered.connect(self.change_folder)
 
@@ -85,6 +169,27 @@ class MainWindow(qtw.QMainWindow):
         missing_action.triggered.connect(self.main_widget.missing_invoked)
         missing_action.setShortcut("m")
 
+        propagation_checker = qtw.QAction("Propagate", self, checkable=True)
+        propagation_checker.setShortcut("p")
+        propagation_checker.triggered.connect(self.main_widget.set_propagation)
+
+        accept_predictions_action = qtw.QAction("Accept_predictions", self)
+        accept_predictions_action.triggered.connect(self.main_widget.accept_predictions_invoked)
+        accept_predictions_action.setShortcut("a")
+
+        interpolate_linear_action = qtw.QAction("Interpolate_linear", self)
+        interpolate_linear_action.triggered.connect(lambda: self.main_widget.interpolate_invoked("linear"))
+
+        interpolate_spline_action = qtw.QAction("Interpolate_spline", self)
+        interpolate_spline_action.triggered.connect(lambda: self.main_widget.interpolate_invoked("spline"))
+
+        zoom_checker = qtw.QAction("Zoom", self, checkable=True)
+        zoom_checker.setShortcut("z")
+        zoom_checker.triggered.connect(self.main_widget.set_zoom_mode)
+
+        timings_checker = qtw.QAction("Timings", self, checkable=True)
+        timings_checker.triggered.connect(self.show_timings)
+
         auto_next_image_checker = qtw.QAction("Auto_Next", self, checkable=True)
         auto_next_image_checker.setChecked(self.main_widget.auto_next_image)
         auto_next_image_checker.triggered.connect(
@@ -94,12 +199,19 @@ class MainWindow(qtw.QMainWindow):
         menubar.addAction(change_folder_action)
         navigationMenu = menubar.addMenu('Navigation')
         annotationMenu = menubar.addMenu('Annotation')
+        viewMenu = menubar.addMenu('View')
 
         navigationMenu.addAction(prev_image_action)
         navigationMenu.addAction(next_image_action)
         navigationMenu.addAction(auto_next_image_checker)
 
         annotationMenu.addAction(missing_action)
+        annotationMenu.addAction(accept_predictions_action)
+        annotationMenu.addAction(propagation_checker)
+        annotationMenu.addAction(interpolate_linear_action)
+        annotationMenu.addAction(interpolate_spline_action)
+        viewMenu.addAction(zoom_checker)
+        viewMenu.addAction(timings_checker)
         logger.debug("Menu has been created.")
 
         self.setGeometry(300, 300, 350, 200)
@@ -113,9 +225,68 @@ def _set_list_item_from_text(lst: qtw.QListWidget, text: str):
     )
 
 
+class ImageListModel(QAbstractListModel):
+    """Keys of the annotator's images with an icon of the status of the active category.
+
+    Rows are backed by the image key list (as it was when the annotator was
+    set) and their data are computed only when a view asks for them, i.e. for
+    visible rows.
+    """
+
+    def __init__(self, annotator: Annotator, ok_icon: QtGui.QIcon, empty_icon: QtGui.QIcon):
+        super().__init__()
+        self._ok_icon = ok_icon
+        self._empty_icon = empty_icon
+        self._set_annotator(annotator)
+
+    def _set_annotator(self, annotator: Annotator):
+        self.annotator = annotator
+        self._keys = annotator.get_image_keys()
+        self._rows = {key: row for row, key in enumerate(self._keys)}
+
+    def reset_annotator(self, annotator: Annotator):
+        self.beginResetModel()
+        self._set_annotator(annotator)
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self._keys)
+
+    def data(self, index: QModelIndex, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        key = self._keys[index.row()]
+        if role == Qt.DisplayRole:
+            return key
+        if role == Qt.DecorationRole:
+            status = self.annotator._annotation_db.get_status(self.annotator.active_cat, key)
+            return self._empty_icon if status == UNSPECIFIED else self._ok_icon
+        return None
+
+    def key(self, row: int) -> str:
+        return self._keys[row]
+
+    def index_of(self, key: str) -> QModelIndex:
+        """Index of `key`, invalid for keys not in the list."""
+        row = self._rows.get(key)
+        return QModelIndex() if row is None else self.index(row)
+
+    def status_changed(self, key: str):
+        index = self.index_of(key)
+        if index.isValid():
+            self.dataChanged.emit(index, index, [Qt.DecorationRole])
+
+    def all_statuses_changed(self):
+        if self.rowCount():
+            self.dataChanged.emit(self.index(0), self.index(self.rowCount() - 1), [Qt.DecorationRole])
+
+
 class MainWidget(qtw.QWidget):
     annotator: Annotator
     auto_next_image: bool = False
+    propagation: bool = False
+    # Emitted from a background thread when the tile pyramid of a key is built.
+    pyramid_ready_signal = pyqtSignal(str)
 
     def __init__(self, annotator):
         super().__init__()
@@ -125,20 +296,15 @@ class MainWidget(qtw.QWidget):
         self._initUI()
 
     def reset_annotator(self, annotator):
+        with self.reporting_write_errors():
+            self.annotator.close()
         self.annotator = annotator
-        logger.debug("reset_annotator 01")
-        self._image_list.blockSignals(True)
-        self._image_list.clear()
-        logger.debug("reset_annotator 02")
-
-        for key in self.annotator.get_image_keys():
-            item = qtw.QListWidgetItem(key)
-            self._image_list.addItem(item)
-        logger.debug("reset_annotator 03")
-
-        self._image_list.blockSignals(False)
-        _set_list_item_from_text(self._image_list, self.annotator.image_key)
-        logger.debug("reset_annotator 04")
+        self.annotator.set_propagation(self.propagation)
+        self._image_list.selectionModel().blockSignals(True)
+        self._image_list_model.reset_annotator(annotator)
+        self._reset_icon_index()
+        self._image_list.selectionModel().blockSignals(False)
+        self.annotator.tile_pyramids.add_listener(self.pyramid_ready_signal.emit)
         self.update()
 
     def _initUI(self):
@@ -158,28 +324,32 @@ class MainWidget(qtw.QWidget):
         _set_list_item_from_text(cat_list, self.annotator.active_cat)
         cat_list.currentItemChanged.connect(self.cat_list_item_changed)
 
-        image_list = self._image_list = qtw.QListWidget()
+        image_list = self._image_list = qtw.QListView()
+        image_list.setUniformItemSizes(True)
         splitter2.addWidget(image_list)
 
         _ok_icon_path = os.path.join(
             os.path.dirname(os.path.abspath(__file__)),
             "ok.png")
-        logger.debug(f"ok_icon_path = {_ok_icon_path}")
+        logger.debug("ok_icon_path = %s", _ok_icon_path)
         self._ok_icon = QtGui.QIcon(_ok_icon_path)
         px = QtGui.QPixmap(16, 16)
         px.fill(Qt.transparent)
         self._empty_icon = QtGui.QIcon(px)
 
-        for key in self.annotator.get_image_keys():
-            item = qtw.QListWidgetItem(key)
-            image_list.addItem(item)
-
-        _set_list_item_from_text(image_list, self.annotator.image_key)
-        image_list.currentItemChanged.connect(self.image_list_item_changed)
+        self._image_list_model = ImageListModel(self.annotator, self._ok_icon, self._empty_icon)
+        image_list.setModel(self._image_list_model)
+        image_list.setCurrentIndex(self._image_list_model.index_of(self.annotator.image_key))
+        image_list.selectionModel().currentChanged.connect(self.image_list_current_changed)
+        self._reset_icon_index()
 
         self.canvas = ImgCanvas(parent=self)
         splitter.addWidget(self.canvas)
         self.canvas.mouse_pressed_signal.connect(self.mouse_pressed_on_canvas)
+        self.canvas.resized_signal.connect(self.canvas_resized)
+        self.canvas.viewport_changed_signal.connect(self.update)
+        self.pyramid_ready_signal.connect(self.pyramid_ready)
+        self.annotator.tile_pyramids.add_listener(self.pyramid_ready_signal.emit)
 
         splitter.setStretchFactor(0, 1)
         splitter.setStretchFactor(1, 8)
@@ -190,49 +360,73 @@ class MainWidget(qtw.QWidget):
         self.show()
         self.update()
 
-    def _update_image_icons(self):
-        logger.debug("Start updating image icons.")
-        image_list = self._image_list
-        for i in range(image_list.count()):
-            item = image_list.item(i)
-            key = item.text()
-            annotation = self.annotator._annotation_db.load_annotation(key)
-            cat_state = annotation.get_cat_state_description(self.annotator.active_cat)
-            if cat_state != "UNSPECIFIED":
-                item.setIcon(self._ok_icon)
-            else:
-                item.setIcon(self._empty_icon)
-        logger.debug(f"Finished updating image icons for {len(image_list)} items.")
+    def _reset_icon_index(self):
+        """Forget shown icons and start listening to status changes of the current annotator."""
+        self._icon_cat = self.annotator.active_cat
+        self._changed_keys = set()
+        self.annotator._annotation_db.add_listener(self._changed_keys.add)
 
+    @timings.timed("gui.update_image_icons")
+    def _update_image_icons(self):
+        """Let the image list query icons of rows whose status (or the active category) has changed."""
+        if self.annotator.active_cat != self._icon_cat:
+            self._image_list_model.all_statuses_changed()
+            self._icon_cat = self.annotator.active_cat
+        else:
+            for key in self._changed_keys:
+                self._image_list_model.status_changed(key)
+        self._changed_keys.clear()
+
+    @timings.timed("gui.update")
     def update(self):
         logger.debug("Entered `MainWidget.update`.")
 
-        ax = self.canvas.ax
-
-        for to_remove in ax.images + ax.collections:
-            to_remove.remove()
-
-        ax.imshow(self.annotator.image)
-        ax.set_title(
-            f"{self.annotator.active_cat}: "
-            f"{self.annotator.get_cat_state_description()}"
-        )
-
-        objects = [ob for ob in self.annotator.objects
-                   if ob["cat"] == self.annotator.active_cat]
-        ax.scatter(
-            x=[ob["x"] for ob in objects],
-            y=[ob["y"] for ob in objects],
-            c="white"
+        self.annotator.set_display_size(*self.canvas.get_display_size())
+        self.canvas.set_full_extent(self.annotator.image_extent)
+
+        image, extent = self.annotator.image, self.annotator.image_extent
+        if self.canvas.zoomed:
+            # Until the pyramid is built, the (reduced) image is shown.
+            pyramid = self.annotator.tile_pyramids.get(self.annotator.image_key)
+            if pyramid is not None:
+                image, extent = pyramid.render(*self.canvas.get_view(), self.canvas.get_display_size())
+
+        cat = self.annotator.active_cat
+        points = self.annotator.annotation.get_points(cat)
+        # Predictions are shown only until the category is specified.
+        predicted_points = [] if points or self.annotator.annotation.is_missing(cat) \
+            else self.annotator.predictions.get_points(cat)
+        self.canvas.show_frame(
+            image=image,
+            extent=extent,
+            xs=[x for x, _ in points],
+            ys=[y for _, y in points],
+            predicted_xs=[x for x, _ in predicted_points],
+            predicted_ys=[y for _, y in predicted_points],
+            title=f"{self.annotator.active_cat}: {self.annotator.get_cat_state_description()}"
         )
+        logger.debug("Redraw (%s) took %.1f ms.", self.canvas.last_redraw_kind, self.canvas.last_redraw_ms)
 
-        self.canvas.draw()
-
-        _set_list_item_from_text(self._image_list, self.annotator.image_key)
+        self._image_list.setCurrentIndex(self._image_list_model.index_of(self.annotator.image_key))
 
         self._update_image_icons()
         logger.debug("Finished `MainWidget.update`.")
 
+    def pyramid_ready(self, key: str):
+        if self.canvas.zoomed and key == self.annotator.image_key:
+            self.update()
+
+    def set_zoom_mode(self, state: bool):
+        """In zoom mode, the wheel zooms around the cursor and dragging with the right button pans."""
+        self.canvas.zoom_mode = state
+        if not state:
+            self.canvas.reset_view()
+        self.update()
+
+    def canvas_resized(self):
+        if self.annotator.set_display_size(*self.canvas.get_display_size()):
+            self.update()
+
     def next_image(self):
         self.annotator.next_image()
         self.update()
@@ -242,18 +436,24 @@ class MainWidget(qtw.QWidget):
         self.update()
 
     def cat_list_item_changed(self, item):
-        logger.debug(f"cat_list_item_changed: {item.text()}")
+        logger.debug("cat_list_item_changed: %s", item.text())
         self.annotator.active_cat = item.text()
         self.update()
 
-    def image_list_item_changed(self, item):
-        logger.debug(f"image_list_item_changed: {item.text()}")
-        self.annotator.image_key = item.text()
-        self.update()
+    def image_list_current_changed(self, current: QModelIndex, previous: QModelIndex):
+        # Row -1 of an invalid index would select the last key.
+        if not current.isValid():
+            return
+        key = self._image_list_model.key(current.row())
+        logger.debug("image_list_current_changed: %s", key)
+        if key != self.annotator.image_key:
+            self.annotator.image_key = key
+            self.update()
 
     def mouse_pressed_on_canvas(self, x, y):
         logger.debug("Start `mouse_pressed_on_canvas`.")
-        self.annotator.add_object(x, y)
+        with self.reporting_write_errors():
+            self.annotator.add_object(x, y)
         if self.auto_next_image:
             self.annotator.next_image()
         self.update()
@@ -261,27 +461,94 @@ class MainWidget(qtw.QWidget):
 
     def missing_invoked(self):
         logger.debug("Start `missing_invoked`.")
-        self.annotator.add_missing()
+        with self.reporting_write_errors():
+            self.annotator.add_missing()
         if self.auto_next_image:
             self.annotator.next_image()
         self.update()
         logger.debug("Finished `missing_invoked`.")
 
+    def accept_predictions_invoked(self):
+        with self.reporting_write_errors():
+            self.annotator.accept_predictions()
+        self.update()
+
+    def interpolate_invoked(self, method: str):
+        with self.reporting_write_errors():
+            n = self.annotator.interpolate(method)
+            logger.info("Interpolated %d objects.", n)
+        self.update()
+
+    @contextlib.contextmanager
+    def reporting_write_errors(self):
+        """Show a warning instead of raising if annotations could not be written."""
+        try:
+            yield
+        except WriteError as exc:
+            logger.error("%s", exc)
+            QMessageBox.warning(self, "Annotations not saved", str(exc))
+
+    def set_propagation(self, state: bool):
+        """Show points propagated from the previous images as predictions."""
+        self.propagation = state
+        self.annotator.set_propagation(state)
+        self.update()
+
     def set_auto_next_image(self, state):
         self.auto_next_image = state
 
 
 class ImgCanvas(FigureCanvasQTAgg):
+    """Canvas showing an image with markers and a title.
+
+    The image and marker artists are created once and updated in place. The
+    markers and the title are animated artists, so when only they change we
+    restore the cached background and blit instead of redrawing the image.
+
+    The axes always show full-resolution image coordinates; the shown image
+    may be a part of the image placed by its extent. In `zoom_mode` the view
+    can be zoomed with the wheel and panned by dragging with the right button.
+    """
     mouse_pressed_signal = pyqtSignal([float, float])
+    resized_signal = pyqtSignal()
+    viewport_changed_signal = pyqtSignal()
+
+    zoom_mode: bool = False
+    zoom_step: float = 1.25
+
+    last_redraw_ms: float = 0.
+    last_redraw_kind: str = ""
 
     def __init__(self, parent=None, width=5, height=4):
-        fig, self.ax = plt.subplots(figsize=(width, height))
+        fig = Figure(figsize=(width, height))
+        self.ax = fig.add_subplot()
         fig.tight_layout(pad=0.5)
         self._setup_FigureCanvas(parent, fig)
 
+        self._image_artist = None
+        self._shown_image = self._shown_extent = None
+        self._scatter = self.ax.scatter([], [], c="white", animated=True)
+        self._predicted_scatter = self.ax.scatter([], [], facecolors="none", edgecolors="yellow", animated=True)
+        self.ax.title.set_animated(True)
+        self.ax.set_autoscale_on(False)
+        self._background = None
+        self._full_extent = None
+        self._view = None
+        self._pan_start = None
+        # Zooming and panning only mark the viewport as changed, the update runs once the pending
+        # mouse events are processed, so that a slow redraw does not lag behind the mouse.
+        self._viewport_timer = QTimer(self)
+        self._viewport_timer.setSingleShot(True)
+        self._viewport_timer.setInterval(0)
+        self._viewport_timer.timeout.connect(self.viewport_changed_signal.emit)
+
         self.setMouseTracking(True)
 
         fig.canvas.mpl_connect("button_press_event", self.onclick)
+        fig.canvas.mpl_connect("draw_event", self._on_draw)
+        fig.canvas.mpl_connect("scroll_event", self._on_scroll)
+        fig.canvas.mpl_connect("motion_notify_event", self._on_motion)
+        fig.canvas.mpl_connect("button_release_event", self._on_release)
 
     def _setup_FigureCanvas(self, parent, fig):
         """Set-up the parent class `FigureCanvas`."""
@@ -293,8 +560,137 @@ class ImgCanvas(FigureCanvasQTAgg):
             qtw.QSizePolicy.Expanding)
         self.updateGeometry()
 
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.resized_signal.emit()
+
+    def get_display_size(self) -> Tuple[int, int]:
+        """Size in screen pixels of the axes showing the image."""
+        bbox = self.ax.get_window_extent()
+        return int(bbox.width), int(bbox.height)
+
+    def set_full_extent(self, extent: Tuple[float, float, float, float]):
+        """Extent of the whole image. Resets the view if it has changed."""
+        if extent != self._full_extent:
+            self._full_extent = extent
+            self._view = None
+
+    @property
+    def zoomed(self) -> bool:
+        return self._view is not None
+
+    def get_view(self) -> Tuple[Tuple[float, float], Tuple[float, float]]:
+        """Shown `(xlim, ylim)` in full-resolution coordinates."""
+        if self._view is not None:
+            return self._view
+        left, right, bottom, top = self._full_extent
+        return (left, right), (bottom, top)
+
+    def reset_view(self):
+        self._view = None
+
+    def _set_view(self, xlim: Tuple[float, float], ylim: Tuple[float, float]):
+        """Set the view, kept inside the image; zooming out to the whole image resets it."""
+        left, right, bottom, top = self._full_extent
+        width, height = min(xlim[1] - xlim[0], right - left), min(ylim[0] - ylim[1], bottom - top)
+        if width >= right - left and height >= bottom - top:
+            self._view = None
+            return
+        x0 = min(max(xlim[0], left), right - width)
+        y1 = min(max(ylim[1], top), bottom - height)
+        self._view = ((x0, x0 + width), (y1 + height, y1))
+
+    def _on_scroll(self, event):
+        if not self.zoom_mode or event.xdata is None:
+            return
+        factor = self.zoom_step ** (-event.step)
+        (x0, x1), (y0, y1) = self.get_view()
+        x, y = event.xdata, event.ydata
+        self._set_view((x + (x0 - x) * factor, x + (x1 - x) * factor), (y + (y0 - y) * factor, y + (y1 - y) * factor))
+        self._viewport_timer.start()
+
+    def _on_motion(self, event):
+        if self._pan_start is None:
+            return
+        (px, py), ((x0, x1), (y0, y1)) = self._pan_start
+        width, height = self.get_display_size()
+        dx = (event.x - px) * (x1 - x0) / width
+        # Screen y goes up while image y goes down.
+        dy = (event.y - py) * (y0 - y1) / height
+        self._set_view((x0 - dx, x1 - dx), (y0 + dy, y1 + dy))
+        self._viewport_timer.start()
+
+    def _on_release(self, event):
+        self._pan_start = None
+
+    def _apply_view(self) -> bool:
+        """Set axes limits to the view. Returns whether they have changed."""
+        xlim, ylim = self.get_view()
+        if tuple(self.ax.get_xlim()) == tuple(xlim) and tuple(self.ax.get_ylim()) == tuple(ylim):
+            return False
+        self.ax.set_xlim(xlim)
+        self.ax.set_ylim(ylim)
+        return True
+
+    def _set_image(self, image: np.ndarray, extent: Tuple[float, float, float, float]) -> bool:
+        """Returns whether the image artist has changed."""
+        if image is self._shown_image and extent == self._shown_extent:
+            return False
+        if self._image_artist is None:
+            self._image_artist = self.ax.imshow(image, extent=extent)
+        else:
+            self._image_artist.set_data(image)
+            self._image_artist.set_extent(extent)
+        # Zoomed crops are at most about twice the screen resolution, nearest neighbour resampling is enough there.
+        self._image_artist.set_interpolation("nearest" if self.zoomed else "antialiased")
+        self._shown_image, self._shown_extent = image, extent
+        return True
+
+    def _on_draw(self, event):
+        self._background = self.copy_from_bbox(self.figure.bbox)
+        self._draw_overlay()
+
+    def _draw_overlay(self):
+        self.ax.draw_artist(self._predicted_scatter)
+        self.ax.draw_artist(self._scatter)
+        self.ax.draw_artist(self.ax.title)
+
+    def show_frame(self, image: np.ndarray, extent: Tuple[float, float, float, float],
+             xs: List[float], ys: List[float], title: str,
+             predicted_xs: List[float] = (), predicted_ys: List[float] = ()):
+        """Show `image` with markers at `xs`, `ys` and hollow markers of predictions.
+
+        Redraws the image only if it has changed.
+        """
+        start = time.perf_counter()
+        image_changed = self._set_image(image, extent)
+        if self._full_extent is None:
+            self._full_extent = extent
+        image_changed = self._apply_view() or image_changed
+        self._scatter.set_offsets(np.column_stack([xs, ys]) if xs else np.empty((0, 2)))
+        self._predicted_scatter.set_offsets(
+            np.column_stack([predicted_xs, predicted_ys]) if len(predicted_xs) else np.empty((0, 2)))
+        self.ax.set_title(title)
+
+        if image_changed or self._background is None:
+            self.draw()
+            self.last_redraw_kind = "full"
+        else:
+            self.restore_region(self._background)
+            self._draw_overlay()
+            self.blit(self.figure.bbox)
+            self.last_redraw_kind = "blit"
+        self.last_redraw_ms = 1000 * (time.perf_counter() - start)
+        if timings.enabled:
+            timings.add(f"canvas.{self.last_redraw_kind}", self.last_redraw_ms)
+
     def onclick(self, event):
-        logging.debug('%s click: button=%d, x=%d, y=%d, xdata=%f, ydata=%f' %
-                      ('double' if event.dblclick else 'single', event.button,
-                       event.x, event.y, event.xdata, event.ydata))
+        if self.zoom_mode and event.button == 3:
+            self._pan_start = (event.x, event.y), self.get_view()
+            return
+        if event.xdata is None:
+            return
+        logger.debug('%s click: button=%d, x=%d, y=%d, xdata=%f, ydata=%f',
+                     'double' if event.dblclick else 'single', event.button,
+                     event.x, event.y, event.xdata, event.ydata)
         self.mouse_pressed_signal.emit(event.xdata, event.ydata)
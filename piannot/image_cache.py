@@ -0,0 +1,106 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Callable, Dict, Hashable, Iterable, Optional
+
+import numpy as np
+
+import logging
+logger = logging.getLogger()
+
+
+class ImageCache:
+    """LRU cache of decoded images with background prefetching.
+
+    Images are loaded by `loader` on a pool of worker threads. The cache
+    evicts least recently used images once their total size exceeds
+    `max_bytes`. Any loaded value with an `nbytes` attribute can be cached.
+    `on_loaded(key)` is called (possibly from a worker thread) after each load.
+    """
+    _loader: Callable[[Hashable], np.ndarray]
+    _images: "OrderedDict[Hashable, np.ndarray]"
+    _pending: Dict[Hashable, Future]
+
+    def __init__(self, loader: Callable[[Hashable], np.ndarray], max_bytes: int = 512 * 2**20, n_workers: int = 2,
+                 on_loaded: Optional[Callable[[Hashable], None]] = None):
+        self._loader = loader
+        self._on_loaded = on_loaded
+        self.max_bytes = max_bytes
+        self._images = OrderedDict()
+        self._n_bytes = 0
+        self._pending = dict()
+        self._lock = threading.RLock()
+        self._executor = ThreadPoolExecutor(max_workers=n_workers, thread_name_prefix="piannot-prefetch")
+
+    def _store(self, key: Hashable, image: np.ndarray):
+        with self._lock:
+            if key in self._images:
+                return
+            self._images[key] = image
+            self._n_bytes += image.nbytes
+            while self._n_bytes > self.max_bytes and len(self._images) > 1:
+                _, evicted = self._images.popitem(last=False)
+                self._n_bytes -= evicted.nbytes
+
+    def _load_and_store(self, key: Hashable) -> np.ndarray:
+        image = self._loader(key)
+        self._store(key, image)
+        if self._on_loaded is not None:
+            self._on_loaded(key)
+        return image
+
+    def _forget_pending(self, key: Hashable, future: Future):
+        with self._lock:
+            if self._pending.get(key) is future:
+                del self._pending[key]
+
+    def get(self, key: Hashable) -> np.ndarray:
+        """Return the image, waiting for a running prefetch or loading it if necessary."""
+        with self._lock:
+            if key in self._images:
+                self._images.move_to_end(key)
+                return self._images[key]
+            future = self._pending.get(key)
+
+        if future is not None and not future.cancelled():
+            try:
+                return future.result()
+            except Exception:
+                logger.debug("Prefetch of %s failed, loading it again.", key)
+
+        return self._load_and_store(key)
+
+    def prefetch(self, keys: Iterable[Hashable]):
+        """Schedule loading of `keys` and cancel scheduled loads of all other keys."""
+        keys = list(keys)
+        wanted = set(keys)
+        with self._lock:
+            for key, future in list(self._pending.items()):
+                if key not in wanted and future.cancel():
+                    self._pending.pop(key, None)
+
+            for key in keys:
+                if key in self._images or key in self._pending:
+                    continue
+                future = self._executor.submit(self._load_and_store, key)
+                self._pending[key] = future
+                future.add_done_callback(lambda f, key=key: self._forget_pending(key, f))
+
+    def clear(self):
+        with self._lock:
+            for future in list(self._pending.values()):
+                future.cancel()
+            self._pending.clear()
+            self._images.clear()
+            self._n_bytes = 0
+
+    def close(self):
+        self.clear()
+        self._executor.shutdown(wait=False)
+
+    @property
+    def n_bytes(self) -> int:
+        return self._n_bytes
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._images
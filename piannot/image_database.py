@@ -1,26 +1,132 @@
 import os
+import re
 import numpy as np
-import PIL
+import PIL.Image
+
+from typing import List, Iterable, Dict, Tuple
+
+from piannot.image_cache import ImageCache
+
+
+def natural_sort_key(key: str) -> list:
+    """Sort key ordering e.g. `frame_2` before `frame_10`."""
+    return [int(t) if t.isdigit() else t for t in re.split(r"(\d+)", key)]
+
+
+REDUCE_FACTORS = (1, 2, 4, 8)
+
+
+def choose_reduce(full_shape: Tuple[int, int], display_size: Tuple[int, int]) -> int:
+    """Largest JPEG DCT scale-down factor keeping at least `display_size` pixels.
+
+    `full_shape` is `(height, width)` of the image, `display_size` is `(width, height)`
+    of the area where it is shown.
+    """
+    height, width = full_shape
+    display_width, display_height = display_size
+    return max(
+        r for r in REDUCE_FACTORS
+        if r == 1 or (width / r >= display_width and height / r >= display_height)
+    )
 
-from typing import List
 
 class ImageDatabase:
     _image_dir: str
-    
+    _keys: List[str]
+    _positions: Dict[str, int]
+    _dir_mtime: int
+    _shapes: Dict[str, Tuple[int, int]]
+
     def __init__(self, image_dir: str):
         self._image_dir = image_dir
-        
+        self._shapes = dict()
+        self.refresh()
+
+    def refresh(self):
+        """Rebuild the key index from the content of the image directory."""
+        self._dir_mtime = self._index_mtime()
+        self._keys = sorted(self._list_keys(), key=natural_sort_key)
+        self._positions = {key: i for i, key in enumerate(self._keys)}
+
+    def _index_mtime(self) -> int:
+        """Modification time of whatever determines the keys."""
+        return os.stat(self._image_dir).st_mtime_ns
+
+    def _list_keys(self) -> List[str]:
+        extensions = {".jpg"}
+        with os.scandir(self._image_dir) as entries:
+            return [
+                name for name, ext in [os.path.splitext(e.name) for e in entries]
+                if ext in extensions
+            ]
+
+    def _refresh_if_changed(self):
+        if self._index_mtime() != self._dir_mtime:
+            self.refresh()
+
     @property
     def key_list(self) -> List[str]:
-        extensions = {".jpg"}
-        all_files =  os.listdir(self._image_dir)
-        return [
-            name for name, ext in [os.path.splitext(f) for f in all_files] 
-            if ext in extensions
-        ]
-    
-    
-    def get_image(self, key) -> np.ndarray:
+        """Naturally sorted keys. The returned list must not be modified."""
+        self._refresh_if_changed()
+        return self._keys
+
+    def index(self, key: str) -> int:
+        """Position of `key` in `key_list`. Raises `ValueError` for unknown keys."""
+        self._refresh_if_changed()
+        try:
+            return self._positions[key]
+        except KeyError:
+            raise ValueError(f"{key} is not in the image database.") from None
+
+    def get_image(self, key, reduce: int = 1) -> np.ndarray:
+        """Decode the image, scaled down roughly `reduce` times.
+
+        JPEGs are decoded directly at the reduced scale, which is much faster
+        than a full decode. The exact shape of the result may be slightly larger
+        than the full shape divided by `reduce`.
+        """
         path = os.path.join(self._image_dir, key + ".jpg")
-        return np.array(PIL.Image.open(path))
-    
\ No newline at end of file
+        with PIL.Image.open(path) as img:
+            width, height = img.size
+            self._shapes[key] = (height, width)
+            if reduce > 1:
+                img.draft(img.mode, (-(-width // reduce), -(-height // reduce)))
+            return np.array(img)
+
+    def get_image_shape(self, key) -> Tuple[int, int]:
+        """Full-resolution `(height, width)` of the image."""
+        if key not in self._shapes:
+            path = os.path.join(self._image_dir, key + ".jpg")
+            with PIL.Image.open(path) as img:
+                width, height = img.size
+            self._shapes[key] = (height, width)
+        return self._shapes[key]
+
+    def prefetch(self, keys: Iterable[str], reduce: int = 1):
+        """Hint that `keys` will be needed soon. No-op without a cache."""
+        pass
+
+    def close(self):
+        pass
+
+
+class PrefetchingImageDatabase(ImageDatabase):
+    """Image database decoding images around the cursor on background threads."""
+    _cache: ImageCache
+
+    def __init__(self, image_dir: str, max_cache_bytes: int = 512 * 2**20, n_workers: int = 2):
+        super().__init__(image_dir)
+        self._cache = ImageCache(
+            loader=lambda key_reduce: ImageDatabase.get_image(self, *key_reduce),
+            max_bytes=max_cache_bytes,
+            n_workers=n_workers
+        )
+
+    def get_image(self, key, reduce: int = 1) -> np.ndarray:
+        return self._cache.get((key, reduce))
+
+    def prefetch(self, keys: Iterable[str], reduce: int = 1):
+        self._cache.prefetch((key, reduce) for key in keys)
+
+    def close(self):
+        self._cache.close()
@@ -0,0 +1,169 @@
+"""Interpolation of object positions between human-annotated keyframes. Run `python interpolation.py --help`."""
+from pathlib import Path
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from piannot.annotation import Annotation
+from piannot.annotation_database import AnnotationDatabase
+
+import logging
+logger = logging.getLogger()
+
+# Per-frame state of a category.
+_EMPTY, _KEYFRAME, _MISSING, _INTERPOLATED = 0, 1, 2, 3
+
+METHODS = ("linear", "spline")
+
+
+def _category_track(annotations: List[Annotation], cat: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """State of `cat` in each frame, its number of objects and their positions padded by NaN."""
+    states = np.zeros(len(annotations), dtype=np.int8)
+    counts = np.zeros(len(annotations), dtype=int)
+    coords = [[]] * len(annotations)
+    for i, annotation in enumerate(annotations):
+        if annotation.is_missing(cat):
+            states[i] = _MISSING
+        else:
+            coords[i] = annotation.get_points(cat)
+            if coords[i]:
+                states[i] = _INTERPOLATED if annotation.is_interpolated(cat) else _KEYFRAME
+                counts[i] = len(coords[i])
+    points = np.full((len(annotations), max(counts.max(initial=0), 1), 2), np.nan)
+    for i in np.flatnonzero(counts).tolist():
+        points[i, :counts[i]] = coords[i]
+    return states, counts, points
+
+
+def interpolate_track(states: np.ndarray, points: np.ndarray, method: str = "linear", max_gap: int = None,
+                      counts: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Frames to fill, their positions interpolated between keyframes and the skipped segments.
+
+    `points` has shape `(n_frames, n_objects, 2)`, with `counts` objects in
+    each frame (all of them by default). Objects are interpolated one by one,
+    matched by their order in the keyframes.
+
+    Frames between two consecutive keyframes are filled unless a missing
+    marker lies between them or the keyframes are more than `max_gap` frames
+    apart. Previously interpolated frames are filled again, keyframes and
+    missing frames never. Segments whose keyframes have different numbers of
+    objects are not filled either, they are returned as `(k1, k2)` pairs.
+    With "spline", segments are cubic Hermite curves with Catmull-Rom
+    tangents, so the track is smooth across keyframes.
+    """
+    if counts is None:
+        counts = np.full(len(states), points.shape[1])
+    keyframes = np.flatnonzero(states == _KEYFRAME)
+    targets = np.flatnonzero((states == _EMPTY) | (states == _INTERPOLATED))
+    if len(keyframes) < 2 or len(targets) == 0:
+        return np.empty(0, dtype=int), np.empty((0,) + points.shape[1:]), np.empty((0, 2), dtype=int)
+
+    # Segment of each target: keyframes `k1 < target < k2`.
+    seg = np.searchsorted(keyframes, targets)
+    inside = (seg > 0) & (seg < len(keyframes))
+    targets, seg = targets[inside], seg[inside]
+    k1, k2 = keyframes[seg - 1], keyframes[seg]
+    n_missing = np.concatenate([[0], np.cumsum(states == _MISSING)])
+    valid = n_missing[k2] == n_missing[k1]
+    if max_gap is not None:
+        valid &= (k2 - k1) <= max_gap
+    same_count = counts[k1] == counts[k2]
+    skipped = np.unique(np.stack([k1, k2], axis=1)[valid & ~same_count], axis=0)
+    valid &= same_count
+    targets, seg, k1, k2 = targets[valid], seg[valid], k1[valid], k2[valid]
+
+    u = ((targets - k1) / (k2 - k1))[:, None, None]
+    p1, p2 = points[k1], points[k2]
+    if method == "linear":
+        return targets, p1 + u * (p2 - p1), skipped
+    if method != "spline":
+        raise ValueError(f"Unknown interpolation method {method}, use one of {METHODS}.")
+
+    # Neighbouring keyframes for tangents; at ends of a run (or across missing markers
+    # or changes of the number of objects) the segment itself.
+    i0 = np.maximum(seg - 2, 0)
+    i3 = np.minimum(seg + 1, len(keyframes) - 1)
+    k0, k3 = keyframes[i0], keyframes[i3]
+    k0 = np.where((i0 < seg - 1) & (n_missing[k1] == n_missing[k0]) & (counts[k0] == counts[k1]), k0, k1)
+    k3 = np.where((i3 > seg) & (n_missing[k3] == n_missing[k2]) & (counts[k3] == counts[k2]), k3, k2)
+    length = (k2 - k1)[:, None, None]
+    # Tangents in frames are scaled to the parameter `u` of the segment.
+    m1 = (points[k2] - points[k0]) / np.maximum(k2 - k0, 1)[:, None, None] * length
+    m2 = (points[k3] - points[k1]) / np.maximum(k3 - k1, 1)[:, None, None] * length
+    u2, u3 = u ** 2, u ** 3
+    return targets, (
+        (2 * u3 - 3 * u2 + 1) * p1 + (u3 - 2 * u2 + u) * m1
+        + (-2 * u3 + 3 * u2) * p2 + (u3 - u2) * m2
+    ), skipped
+
+
+def interpolate_annotations(annotation_db: AnnotationDatabase, keys: Sequence[str], cats: Sequence[str],
+                            method: str = "linear", max_gap: int = None) -> int:
+    """Fill frames `keys` (in order) between keyframes of each category and save them in one batch.
+
+    Interpolated objects are marked as such; annotating the category by hand
+    replaces them. Interpolated objects of earlier runs which no longer lie
+    between valid keyframes are removed. Segments between keyframes with
+    different numbers of objects are skipped with a warning. Returns the
+    number of interpolated objects.
+    """
+    annotations = [annotation_db.load_annotation(key) for key in keys]
+    changed: Dict[int, Annotation] = {}
+    n_objects = 0
+    for cat in cats:
+        states, counts, points = _category_track(annotations, cat)
+        targets, positions, skipped = interpolate_track(states, points, method=method, max_gap=max_gap,
+                                                        counts=counts)
+        if len(skipped):
+            logger.warning(
+                "Not interpolating %s between %d pairs of keyframes with different numbers of objects: %s",
+                cat, len(skipped), ", ".join(f"{keys[k1]}-{keys[k2]}" for k1, k2 in skipped.tolist())
+            )
+        # Interpolated points outside of the valid segments are left over from earlier runs.
+        for i in np.setdiff1d(np.flatnonzero(states == _INTERPOLATED), targets).tolist():
+            annotations[i].remove(cat)
+            changed[i] = annotations[i]
+        for i, frame_positions in zip(targets.tolist(), positions):
+            annotations[i].remove(cat)
+            for x, y in frame_positions[~np.isnan(frame_positions[:, 0])].tolist():
+                annotations[i].add_object(cat, x, y, unique=False, interpolated=True)
+                n_objects += 1
+            changed[i] = annotations[i]
+    annotation_db.save_annotations((keys[i], annotation) for i, annotation in sorted(changed.items()))
+    return n_objects
+
+
+def _retrieve_cmd_line_args():
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("frame_dir", help="Folder with the frames; its frames define the frame order.")
+    parser.add_argument("annot_dir", help="Folder with json annotations of the frames.")
+    parser.add_argument("--sqlite", default=None,
+                        help="SQLite annotation file; annot_dir is then the folder name within it.")
+    parser.add_argument("--cats", nargs="+", required=True, help="Categories to interpolate.")
+    parser.add_argument("--method", choices=METHODS, default="linear", help="Interpolation method.")
+    parser.add_argument("--max_gap", type=int, default=None,
+                        help="Do not fill between keyframes more than this many frames apart.")
+    return parser.parse_args()
+
+
+def _main():
+    from piannot.annotation_database import SqliteAnnotationDatabase
+    from piannot.image_database import ImageDatabase
+    from piannot.packed_frames import PackedImageDatabase, is_packed_dir
+
+    args = _retrieve_cmd_line_args()
+    frame_dir = Path(args.frame_dir)
+    image_db = PackedImageDatabase(frame_dir) if is_packed_dir(frame_dir) else ImageDatabase(str(frame_dir))
+    if args.sqlite:
+        annotation_db = SqliteAnnotationDatabase(args.sqlite, folder=args.annot_dir)
+    else:
+        annotation_db = AnnotationDatabase(args.annot_dir)
+    n = interpolate_annotations(annotation_db, image_db.key_list, args.cats, method=args.method,
+                                max_gap=args.max_gap)
+    annotation_db.close()
+    print(f"Interpolated {n} objects.")
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,75 @@
+"""Convert annotations between the per-frame json layout and a project SQLite file."""
+import os
+import json
+from pathlib import Path
+from typing import Tuple
+
+from piannot.annotation import Annotation
+from piannot.annotation_database import connect_sqlite
+
+
+def json_to_sqlite(annot_dir: Path, db_path: Path) -> int:
+    """Copy all json annotations under `annot_dir` to the SQLite file `db_path`.
+
+    Annotations already present in the SQLite file are overwritten.
+    Returns the number of copied annotations.
+    """
+    connection = connect_sqlite(str(db_path))
+    count = 0
+    try:
+        for dirpath, _, filenames in os.walk(annot_dir):
+            folder = Path(dirpath).relative_to(annot_dir).as_posix()
+            folder = "" if folder == "." else folder
+            rows = [
+                (folder, os.path.splitext(f)[0], Annotation.load(os.path.join(dirpath, f)).to_json())
+                for f in filenames if os.path.splitext(f)[1] == ".json"
+            ]
+            with connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO annotations (folder, key, data) VALUES (?, ?, ?)", rows)
+            count += len(rows)
+    finally:
+        connection.close()
+    return count
+
+
+def sqlite_to_json(db_path: Path, annot_dir: Path) -> int:
+    """Write all annotations from the SQLite file `db_path` as json files under `annot_dir`.
+
+    Returns the number of written annotations.
+    """
+    connection = connect_sqlite(str(db_path))
+    count = 0
+    try:
+        for folder, key, data in connection.execute("SELECT folder, key, data FROM annotations"):
+            out_dir = annot_dir / folder
+            out_dir.mkdir(parents=True, exist_ok=True)
+            Annotation(**json.loads(data)).to_json(path=str(out_dir / (key + ".json")))
+            count += 1
+    finally:
+        connection.close()
+    return count
+
+
+def _retrieve_cmd_line_args() -> Tuple[str, Path, Path]:
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("direction", choices=["to_sqlite", "to_json"])
+    parser.add_argument("annot_dir", help="folder with json annotations (source or target)")
+    parser.add_argument("db_path", help="SQLite file (target or source)")
+    args = parser.parse_args()
+
+    return args.direction, Path(args.annot_dir), Path(args.db_path)
+
+
+def _main():
+    direction, annot_dir, db_path = _retrieve_cmd_line_args()
+    if direction == "to_sqlite":
+        count = json_to_sqlite(annot_dir, db_path)
+    else:
+        count = sqlite_to_json(db_path, annot_dir)
+    print(f"Migrated {count} annotations.")
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,126 @@
+"""Frames of a folder packed into one uint8 array file with a json index."""
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Dict, List, Tuple, Optional
+
+import numpy as np
+import PIL.Image
+
+from piannot.fileio import atomic_write_text
+from piannot.image_database import ImageDatabase
+
+PACK_NAME = "frames.pack"
+INDEX_NAME = "frames_index.json"
+
+
+def is_packed_dir(folder: Path) -> bool:
+    return (Path(folder) / INDEX_NAME).exists()
+
+
+def _read_index(folder: Path) -> Optional[dict]:
+    try:
+        with open(Path(folder) / INDEX_NAME, "rt") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+class PackedFrameWriter:
+    """Appends frames, optionally scaled down `reduce` times, to the pack of `folder`.
+
+    All frames of a pack have the same shape. The index, mapping keys to slots
+    of the pack, is written by `flush` and `close`; frames added after the last
+    flush are discarded when the pack is opened again. A key added again
+    points to its new slot. Safe to use from several threads.
+    """
+    folder: Path
+    reduce: int
+    _slots: Dict[str, int]
+
+    def __init__(self, folder: Path, reduce: int = 1):
+        self.folder = Path(folder)
+        self.reduce = reduce
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+        index = _read_index(self.folder)
+        if index is not None and index["reduce"] == reduce:
+            self._slots = index["slots"]
+            self._n_slots = index["n_slots"]
+            self._shape = tuple(index["shape"])
+            self._full_shape = tuple(index["full_shape"])
+        else:
+            self._slots, self._n_slots, self._shape, self._full_shape = {}, 0, None, None
+        self._file = open(self.folder / PACK_NAME, "r+b" if self._n_slots else "wb")
+        self._file.truncate(self._n_slots * self._frame_bytes)
+        self._file.seek(0, os.SEEK_END)
+
+    @property
+    def _frame_bytes(self) -> int:
+        return int(np.prod(self._shape)) if self._shape else 0
+
+    def add(self, key: str, frame: np.ndarray):
+        full_shape = frame.shape[:2]
+        if self.reduce > 1:
+            frame = np.asarray(PIL.Image.fromarray(frame).reduce(self.reduce))
+        frame = np.ascontiguousarray(frame, dtype=np.uint8)
+        with self._lock:
+            if self._shape is None:
+                self._shape, self._full_shape = frame.shape, full_shape
+            assert frame.shape == self._shape, f"Frame {key} has shape {frame.shape}, the pack has {self._shape}."
+            self._file.write(frame.tobytes())
+            self._slots[key] = self._n_slots
+            self._n_slots += 1
+
+    def flush(self):
+        with self._lock:
+            self._file.flush()
+            if self._shape is None:
+                return
+            index = {
+                "slots": self._slots,
+                "n_slots": self._n_slots,
+                "shape": list(self._shape),
+                "full_shape": list(self._full_shape),
+                "dtype": "uint8",
+                "reduce": self.reduce,
+            }
+            atomic_write_text(str(self.folder / INDEX_NAME), json.dumps(index))
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+
+class PackedImageDatabase(ImageDatabase):
+    """Image database reading frames from a pack as zero-copy memory-mapped views."""
+    _frames: np.memmap
+    _slots: Dict[str, int]
+    _full_shape: Tuple[int, int]
+    _pack_reduce: int
+
+    def _index_mtime(self) -> int:
+        return os.stat(Path(self._image_dir) / INDEX_NAME).st_mtime_ns
+
+    def _list_keys(self) -> List[str]:
+        index = _read_index(self._image_dir)
+        self._slots = index["slots"]
+        self._full_shape = tuple(index["full_shape"])
+        self._pack_reduce = index["reduce"]
+        self._frames = np.memmap(
+            Path(self._image_dir) / PACK_NAME, dtype=index["dtype"], mode="r",
+            shape=(index["n_slots"],) + tuple(index["shape"])
+        )
+        return list(self._slots)
+
+    def get_image(self, key, reduce: int = 1) -> np.ndarray:
+        """View of the packed frame. For `reduce` above the reduction of the pack, every n-th pixel is taken."""
+        self._refresh_if_changed()
+        frame = self._frames[self._slots[key]]
+        step = reduce // self._pack_reduce
+        return frame[::step, ::step] if step > 1 else frame
+
+    def get_image_shape(self, key) -> Tuple[int, int]:
+        return self._full_shape
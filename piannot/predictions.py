@@ -0,0 +1,151 @@
+"""Model predictions kept in a layer separate from human annotations. Run `python predictions.py --help` to import them."""
+import csv
+import io
+import os
+from pathlib import Path
+from typing import Dict, Sequence, Tuple
+
+import numpy as np
+
+from piannot.annotation import Annotation
+from piannot.fileio import atomic_write_bytes
+
+PREDICTIONS_NAME = ".predictions.npz"
+
+# Columns of stored predictions; `key` is the frame key within its folder.
+COLUMNS = ("key", "cat", "x", "y", "confidence")
+
+
+def validate_predictions(frames: np.ndarray, cats: np.ndarray, x: np.ndarray, y: np.ndarray,
+                         confidence: np.ndarray, known_cats: Sequence[str] = None):
+    """Raise `ValueError` describing the first invalid row, if any."""
+    n = len(frames)
+    if not all(len(col) == n for col in (cats, x, y, confidence)):
+        raise ValueError("All prediction columns must have the same length.")
+    problems = {
+        "empty frame": np.char.str_len(frames) == 0,
+        "non-finite coordinate": ~(np.isfinite(x) & np.isfinite(y)),
+        "confidence outside [0, 1]": ~((confidence >= 0) & (confidence <= 1)),
+    }
+    if known_cats is not None:
+        problems["unknown category"] = ~np.isin(cats, list(known_cats))
+    for problem, bad in problems.items():
+        if bad.any():
+            i = int(np.argmax(bad))
+            raise ValueError(
+                f"{int(bad.sum())} predictions with {problem}, e.g. row {i}: "
+                f"{frames[i]}, {cats[i]}, {x[i]}, {y[i]}, {confidence[i]}."
+            )
+
+
+def _read_folder_predictions(path: Path) -> Dict[str, np.ndarray]:
+    with np.load(path) as npz:
+        return {name: npz[name] for name in COLUMNS}
+
+
+def _write_folder_predictions(path: Path, columns: Dict[str, np.ndarray]):
+    buffer = io.BytesIO()
+    np.savez(buffer, **columns)
+    atomic_write_bytes(str(path), buffer.getvalue())
+
+
+def import_predictions(parent_annot_dir: Path, frames: Sequence[str], cats: Sequence[str], x: Sequence[float],
+                       y: Sequence[float], confidence: Sequence[float], known_cats: Sequence[str] = None) -> int:
+    """Store predictions given as columns; `frames` are paths `folder/key` relative to `parent_annot_dir`.
+
+    All predictions of a frame replace its previously imported predictions.
+    Human annotations are never touched. Each folder is written once, as one
+    `.predictions.npz` file. Returns the number of imported predictions.
+    """
+    frames, cats = np.asarray(frames, dtype=str), np.asarray(cats, dtype=str)
+    x, y = np.asarray(x, dtype=np.float32), np.asarray(y, dtype=np.float32)
+    confidence = np.asarray(confidence, dtype=np.float32)
+    validate_predictions(frames, cats, x, y, confidence, known_cats=known_cats)
+
+    parts = np.char.rpartition(frames, "/")
+    folders, inverse = np.unique(parts[:, 0], return_inverse=True)
+    order = np.argsort(inverse, kind="stable")
+    bounds = np.searchsorted(inverse[order], np.arange(len(folders) + 1))
+    for folder_id, folder in enumerate(folders):
+        rows = order[bounds[folder_id]:bounds[folder_id + 1]]
+        new = {"key": parts[rows, 2], "cat": cats[rows], "x": x[rows], "y": y[rows], "confidence": confidence[rows]}
+        annot_dir = parent_annot_dir / folder
+        annot_dir.mkdir(parents=True, exist_ok=True)
+        path = annot_dir / PREDICTIONS_NAME
+        if path.exists():
+            old = _read_folder_predictions(path)
+            keep = ~np.isin(old["key"], new["key"])
+            new = {name: np.concatenate([old[name][keep], new[name]]) for name in COLUMNS}
+        by_key = np.argsort(new["key"], kind="stable")
+        _write_folder_predictions(path, {name: col[by_key] for name, col in new.items()})
+    return len(frames)
+
+
+def read_prediction_file(path: Path) -> Tuple[np.ndarray, ...]:
+    """Columns `frame, cat, x, y, confidence` of a csv (with header), npz or structured npy file."""
+    names = ("frame", "cat", "x", "y", "confidence")
+    if path.suffix == ".csv":
+        with open(path, "rt", newline="") as file:
+            reader = csv.DictReader(file)
+            rows = [tuple(row[name] for name in names) for row in reader]
+        columns = list(zip(*rows)) if rows else [()] * len(names)
+    elif path.suffix == ".npz":
+        with np.load(path) as data:
+            columns = [data[name] for name in names]
+    elif path.suffix == ".npy":
+        data = np.load(path)
+        columns = [data[name] for name in names]
+    else:
+        raise ValueError(f"Unsupported prediction file {path}, use a .csv, .npz or .npy file.")
+    frames, cats = np.asarray(columns[0], dtype=str), np.asarray(columns[1], dtype=str)
+    return (frames, cats) + tuple(np.asarray(col, dtype=np.float32) for col in columns[2:])
+
+
+class PredictionDatabase:
+    """Read-only predictions of one frame folder."""
+    _columns: Dict[str, np.ndarray]
+
+    def __init__(self, annotation_dir: str):
+        path = Path(annotation_dir) / PREDICTIONS_NAME
+        if path.exists():
+            self._columns = _read_folder_predictions(path)
+        else:
+            self._columns = {name: np.empty(0, dtype=str if name in ("key", "cat") else np.float32)
+                             for name in COLUMNS}
+
+    def __len__(self):
+        return len(self._columns["key"])
+
+    def load_annotation(self, key: str, min_confidence: float = 0.) -> Annotation:
+        """Predictions of `key` with at least `min_confidence` as an annotation."""
+        keys = self._columns["key"]
+        start, end = np.searchsorted(keys, key, side="left"), np.searchsorted(keys, key, side="right")
+        rows = np.arange(start, end)
+        rows = rows[self._columns["confidence"][rows] >= min_confidence]
+        cats, xs, ys = (self._columns[name][rows].tolist() for name in ("cat", "x", "y"))
+        return Annotation(objects=[{"cat": cat, "x": x, "y": y} for cat, x, y in zip(cats, xs, ys)])
+
+
+def _retrieve_cmd_line_args():
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("annot_dir", help="Parent folder of annotations.")
+    parser.add_argument("prediction_file",
+                        help="csv file with header `frame,cat,x,y,confidence`, or npz/npy file with these columns. "
+                             "Frames are paths `folder/key` relative to annot_dir.")
+    parser.add_argument("--cats", nargs="+", default=None, help="Reject predictions of other categories.")
+    parser.add_argument("--min_confidence", type=float, default=0., help="Skip less confident predictions.")
+    return parser.parse_args()
+
+
+def _main():
+    args = _retrieve_cmd_line_args()
+    frames, cats, x, y, confidence = read_prediction_file(Path(args.prediction_file))
+    keep = confidence >= args.min_confidence
+    n = import_predictions(Path(args.annot_dir), frames[keep], cats[keep], x[keep], y[keep], confidence[keep],
+                           known_cats=args.cats)
+    print(f"Imported {n} predictions into {os.path.abspath(args.annot_dir)}.")
+
+
+if __name__ == "__main__":
+    _main()
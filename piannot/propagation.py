@@ -0,0 +1,64 @@
+"""Propagation of annotated points to the next frame by constant velocity and template matching."""
+from typing import Optional, Tuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+Point = Tuple[float, float]
+
+
+def _gray_crop(image: np.ndarray, x: int, y: int, radius: int) -> Tuple[np.ndarray, int, int]:
+    """Grayscale float crop of `image` of `radius` around `(x, y)`, clipped to the image, and its top-left corner."""
+    h, w = image.shape[:2]
+    left, top = max(x - radius, 0), max(y - radius, 0)
+    crop = image[top:min(y + radius + 1, h), left:min(x + radius + 1, w)]
+    crop = crop.astype(np.float32)
+    if crop.ndim == 3:
+        crop = crop.mean(axis=2)
+    return crop, left, top
+
+
+def _box_sums(a: np.ndarray, shape: Tuple[int, int]) -> np.ndarray:
+    """Sums of `a` over all windows of `shape`, via an integral image."""
+    integral = np.zeros((a.shape[0] + 1, a.shape[1] + 1), dtype=np.float64)
+    integral[1:, 1:] = a.cumsum(axis=0).cumsum(axis=1)
+    th, tw = shape
+    return integral[th:, tw:] - integral[:-th, tw:] - integral[th:, :-tw] + integral[:-th, :-tw]
+
+
+class PointPropagator:
+    """Predicts where a point of the previous frame is in the current frame.
+
+    The point is first moved by its velocity between the two previous frames,
+    then the template of `template_radius` around it in the previous frame is
+    searched for within `search_radius` pixels by zero-mean sum of squared
+    differences. Coordinates are pixel coordinates of the given images.
+    """
+    template_radius: int
+    search_radius: int
+
+    def __init__(self, template_radius: int = 8, search_radius: int = 24):
+        self.template_radius = template_radius
+        self.search_radius = search_radius
+
+    def propagate(self, prev_image: np.ndarray, image: np.ndarray, p1: Point, p0: Optional[Point] = None) -> Point:
+        """Position in `image` of point `p1` of `prev_image`; `p0` is the point in the frame before, if known."""
+        guess = (2 * p1[0] - p0[0], 2 * p1[1] - p0[1]) if p0 is not None else p1
+        r = self.template_radius
+        template, _, _ = _gray_crop(prev_image, int(round(p1[0])), int(round(p1[1])), r)
+        if template.shape != (2 * r + 1, 2 * r + 1):
+            return guess
+        gx, gy = int(round(guess[0])), int(round(guess[1]))
+        window, left, top = _gray_crop(image, gx, gy, r + self.search_radius)
+        if window.shape[0] < template.shape[0] or window.shape[1] < template.shape[1]:
+            return guess
+
+        # sum((w - mean(w) - t)^2) = sum(w^2) - sum(w)^2 / n - 2 sum(w t) + sum(t^2), for zero-mean t.
+        template = template - template.mean()
+        n = template.size
+        cross = np.einsum("ijkl,kl->ij", sliding_window_view(window, template.shape), template)
+        sums = _box_sums(window, template.shape)
+        ssd = _box_sums(window ** 2, template.shape) - sums ** 2 / n - 2 * cross
+        row, col = np.unravel_index(np.argmin(ssd), ssd.shape)
+        # The template is centred on the rounded `p1`, so add its sub-pixel offset back.
+        return (float(left + col + r + p1[0] - round(p1[0])), float(top + row + r + p1[1] - round(p1[1])))
@@ -1,45 +1,72 @@
 import sys
 from pathlib import Path
-from typing import Tuple, List
+from typing import Tuple, List, Optional
 
 import PyQt5.QtWidgets as qtw
+from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QPixmap
 
 from piannot import data_dir
-from piannot.annotator_selector import AnnotatorSelector
-from piannot.gui import MainWindow
 
 import logging
 logger = logging.getLogger()
-logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
 
 
-def _run(cats: List[str], parent_frame_dir: Path = None, parent_annot_dir: Path = None):
-    annotator_selector = AnnotatorSelector(cats=cats, parent_frame_dir=parent_frame_dir,
-                                           parent_annot_dir=parent_annot_dir)
-
+def _run(cats: List[str], parent_frame_dir: Path = None, parent_annot_dir: Path = None,
+         annotation_backend: str = "json", fsync: bool = False, timings_file: str = None):
     app = qtw.QApplication(sys.argv)
+    # Show something before the heavy modules (numpy, matplotlib) are imported.
+    pixmap = QPixmap(360, 120)
+    pixmap.fill(Qt.white)
+    splash = qtw.QSplashScreen(pixmap)
+    splash.showMessage("Loading piannot...", Qt.AlignCenter)
+    splash.show()
+    app.processEvents()
+
+    from piannot.annotator_selector import AnnotatorSelector
+    from piannot.gui import MainWindow
+    from piannot.timing import timings
+
+    annotator_selector = AnnotatorSelector(cats=cats, parent_frame_dir=parent_frame_dir,
+                                           parent_annot_dir=parent_annot_dir,
+                                           annotation_backend=annotation_backend, fsync=fsync)
     ex = MainWindow(annotator_selector)
-    sys.exit(app.exec_())
+    splash.finish(ex)
+    exit_code = app.exec_()
+    if timings_file:
+        timings.dump(timings_file)
+    sys.exit(exit_code)
 
 
-def _parse_args() -> Tuple[Path, Path, List[str]]:
+def _parse_args() -> Tuple[Path, Path, List[str], str, bool, Optional[str]]:
     import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument("--image_dir", default=None, help="path to folder with jpg images")
     parser.add_argument("--annot_dir", default=None, help="path to folder with annotation json files.")
+    parser.add_argument("--backend", choices=["json", "sqlite"], default="json",
+                        help="Store annotations as json files or in one SQLite file in annot_dir.")
+    parser.add_argument("--fsync", action="store_true",
+                        help="Flush every annotation write to the disk. Safer on power loss but slower.")
+    parser.add_argument("--log_level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+                        help="Level of messages printed to stdout. Defaults to INFO.")
+    parser.add_argument("--timings_file", default=None,
+                        help="On exit, write latency statistics of the timed operations to this json file.")
     args = parser.parse_args()
+    logging.basicConfig(stream=sys.stdout, level=args.log_level)
 
     image_dir = Path(args.image_dir or data_dir / "frames")
     annot_dir = Path(args.annot_dir or data_dir / "annotations")
     cats = ["ball", "head1", "head2", "bat1", "bat2", "player1", "player2"]
 
-    return image_dir, annot_dir, cats
+    return image_dir, annot_dir, cats, args.backend, args.fsync, args.timings_file
 
 
 def _main():
-    parent_frame_dir, parent_annot_dir, cats = _parse_args()
-    logger.debug(f"cats={cats}, parent_frame_dir={parent_frame_dir}, parent_annot_dir={parent_annot_dir}")
-    _run(cats=cats, parent_frame_dir=parent_frame_dir, parent_annot_dir=parent_annot_dir)
+    parent_frame_dir, parent_annot_dir, cats, backend, fsync, timings_file = _parse_args()
+    logger.debug("cats=%s, parent_frame_dir=%s, parent_annot_dir=%s, backend=%s, fsync=%s",
+                 cats, parent_frame_dir, parent_annot_dir, backend, fsync)
+    _run(cats=cats, parent_frame_dir=parent_frame_dir, parent_annot_dir=parent_annot_dir,
+         annotation_backend=backend, fsync=fsync, timings_file=timings_file)
 
 
 if __name__ == "__main__":
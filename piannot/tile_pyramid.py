@@ -0,0 +1,108 @@
+"""Multi-resolution tile pyramids for zooming into high-resolution images."""
+import math
+from typing import List, Tuple, Optional, Callable
+
+import numpy as np
+
+from piannot.image_cache import ImageCache
+from piannot.image_database import ImageDatabase
+
+TILE_SIZE = 256
+
+
+def _downsample(image: np.ndarray) -> np.ndarray:
+    """Halve the resolution by averaging 2x2 blocks; odd edges are padded by repeating the last pixels."""
+    h, w = image.shape[:2]
+    if h % 2 or w % 2:
+        pad = [(0, h % 2), (0, w % 2)] + [(0, 0)] * (image.ndim - 2)
+        image = np.pad(image, pad, mode="edge")
+    blocks = image.reshape((image.shape[0] // 2, 2, image.shape[1] // 2, 2) + image.shape[2:])
+    return (blocks.sum(axis=(1, 3), dtype=np.uint16) // 4).astype(image.dtype)
+
+
+class TilePyramid:
+    """An image and its successive halvings, cut into `TILE_SIZE` tiles.
+
+    Coordinates are full-resolution pixel coordinates, also when `image` has
+    been decoded at a lower resolution than `full_shape`.
+    """
+    levels: List[np.ndarray]
+    full_shape: Tuple[int, int]
+
+    def __init__(self, image: np.ndarray, full_shape: Tuple[int, int] = None):
+        self.full_shape = full_shape or image.shape[:2]
+        self.levels = [image]
+        while max(self.levels[-1].shape[:2]) > TILE_SIZE:
+            self.levels.append(_downsample(self.levels[-1]))
+
+    @property
+    def nbytes(self) -> int:
+        return sum(level.nbytes for level in self.levels)
+
+    def _scale(self, level: int) -> float:
+        """Full-resolution pixels per pixel of `level`."""
+        return self.full_shape[1] / self.levels[0].shape[1] * 2 ** level
+
+    def choose_level(self, full_pixels_per_screen_pixel: float) -> int:
+        """Coarsest level still having at least one pixel per screen pixel."""
+        ratio = full_pixels_per_screen_pixel / self._scale(0)
+        level = int(math.floor(math.log2(ratio))) if ratio > 1 else 0
+        return min(level, len(self.levels) - 1)
+
+    def render(self, xlim: Tuple[float, float], ylim: Tuple[float, float],
+               display_size: Tuple[int, int]) -> Tuple[np.ndarray, Tuple[float, float, float, float]]:
+        """Pixels of the viewport `xlim` x `ylim` at a level matching `display_size` screen pixels.
+
+        Returns a view (not a copy) of the level array spanning the viewport
+        and its extent `(left, right, bottom, top)` in full-resolution
+        coordinates. Matplotlib resamples the whole array it is given on every
+        draw, so nothing outside of the viewport is included.
+        """
+        (x0, x1), (y0, y1) = sorted(xlim), sorted(ylim)
+        width, height = max(display_size[0], 1), max(display_size[1], 1)
+        level = self.choose_level(max((x1 - x0) / width, (y1 - y0) / height))
+        image, scale = self.levels[level], self._scale(level)
+
+        def pixel_range(lo: float, hi: float, size: int) -> Tuple[int, int]:
+            first = min(max(int(math.floor((lo + 0.5) / scale)), 0), size - 1)
+            return first, max(min(int(math.ceil((hi + 0.5) / scale)), size), first + 1)
+
+        left, right = pixel_range(x0, x1, image.shape[1])
+        top, bottom = pixel_range(y0, y1, image.shape[0])
+        crop = image[top:bottom, left:right]
+        extent = (
+            left * scale - 0.5, right * scale - 0.5,
+            bottom * scale - 0.5, top * scale - 0.5,
+        )
+        return crop, extent
+
+
+class TilePyramidCache:
+    """Tile pyramids of full-resolution images of an image database, built on a background thread."""
+    _listeners: List[Callable[[str], None]]
+
+    def __init__(self, image_db: ImageDatabase, max_bytes: int = 256 * 2**20):
+        self._image_db = image_db
+        self._listeners = []
+        self._cache = ImageCache(loader=self._build, max_bytes=max_bytes, n_workers=1, on_loaded=self._notify)
+
+    def _build(self, key: str) -> TilePyramid:
+        return TilePyramid(self._image_db.get_image(key, reduce=1), self._image_db.get_image_shape(key))
+
+    def _notify(self, key: str):
+        for listener in self._listeners:
+            listener(key)
+
+    def add_listener(self, listener: Callable[[str], None]):
+        """Call `listener(key)` from the building thread when the pyramid of `key` is ready."""
+        self._listeners.append(listener)
+
+    def get(self, key: str) -> Optional[TilePyramid]:
+        """The pyramid of `key` if it is built, otherwise start building it and return None."""
+        if key in self._cache:
+            return self._cache.get(key)
+        self._cache.prefetch([key])
+        return None
+
+    def close(self):
+        self._cache.close()
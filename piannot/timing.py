@@ -0,0 +1,119 @@
+"""Lightweight timing spans aggregated into latency statistics."""
+import functools
+import json
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import ContextManager, Dict, Iterator
+
+import numpy as np
+
+from piannot.fileio import atomic_write_text
+
+# Upper bounds in ms of the histogram buckets; the last bucket is unbounded.
+BUCKET_BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+class _Span:
+    """Durations in ms of one span name: the last `capacity` samples and a histogram of all of them."""
+
+    def __init__(self, capacity: int):
+        self.samples = np.zeros(capacity)
+        self.count = 0
+        self.total_ms = 0.
+        self.max_ms = 0.
+        self.buckets = np.zeros(len(BUCKET_BOUNDS_MS) + 1, dtype=np.int64)
+
+    def add(self, ms: float):
+        self.samples[self.count % len(self.samples)] = ms
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        self.buckets[np.searchsorted(BUCKET_BOUNDS_MS, ms, side="right")] += 1
+
+    def summary(self) -> dict:
+        recent = self.samples[:min(self.count, len(self.samples))]
+        p50, p95, p99 = np.percentile(recent, [50, 95, 99])
+        return {
+            "count": self.count, "mean_ms": self.total_ms / self.count, "max_ms": self.max_ms,
+            "p50_ms": p50, "p95_ms": p95, "p99_ms": p99,
+            "histogram": {
+                f"<{bound}ms" if bound is not None else f">={BUCKET_BOUNDS_MS[-1]}ms": int(n)
+                for bound, n in zip(BUCKET_BOUNDS_MS + (None,), self.buckets)
+            },
+        }
+
+
+_NO_SPAN = nullcontext()
+
+
+class Timings:
+    """Named timing spans. Percentiles are computed over the last `capacity` samples of each span.
+
+    When not `enabled`, `span` returns a shared no-op context manager and
+    `timed` functions are called directly.
+    """
+    enabled: bool
+
+    def __init__(self, enabled: bool = True, capacity: int = 10_000):
+        self.enabled = enabled
+        self.capacity = capacity
+        self._spans: Dict[str, _Span] = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, ms: float):
+        with self._lock:
+            span = self._spans.get(name)
+            if span is None:
+                span = self._spans[name] = _Span(self.capacity)
+            span.add(ms)
+
+    def span(self, name: str) -> ContextManager[None]:
+        if not self.enabled:
+            return _NO_SPAN
+        return self._span(name)
+
+    @contextmanager
+    def _span(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, 1000 * (time.perf_counter() - start))
+
+    def timed(self, name: str):
+        """Decorator timing each call of a function as span `name`."""
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.add(name, 1000 * (time.perf_counter() - start))
+            return wrapper
+        return decorator
+
+    def summary(self) -> Dict[str, dict]:
+        with self._lock:
+            return {name: span.summary() for name, span in sorted(self._spans.items())}
+
+    def overlay_text(self) -> str:
+        """One-line p50/p95/p99 summary of all spans, e.g. for a status bar."""
+        return "  |  ".join(
+            f"{name} {s['p50_ms']:.1f}/{s['p95_ms']:.1f}/{s['p99_ms']:.1f} ms"
+            for name, s in self.summary().items()
+        )
+
+    def dump(self, path: str):
+        atomic_write_text(path, json.dumps(self.summary(), indent=1))
+
+    def reset(self):
+        with self._lock:
+            self._spans.clear()
+
+
+# Timings of the hot paths of the annotator.
+timings = Timings()
@@ -0,0 +1,133 @@
+import atexit
+import threading
+import time
+from typing import Callable, Dict, Hashable, Iterable, List, Tuple, Any
+
+import logging
+logger = logging.getLogger()
+
+
+class WriteError(Exception):
+    """Writing of queued items has failed; the items are still pending unless the queue is closed."""
+
+
+class WriteBehindQueue:
+    """Writes items on a background thread.
+
+    Items put under the same key before they are written are coalesced and
+    only the last one is written. Pending items are written in batches by
+    `write_batch`. The queue is flushed on `close` and at interpreter exit.
+
+    Items of a failed batch are queued again, unless newer items with the same
+    keys have been put meanwhile, and retried with exponential backoff from
+    `retry_delay` up to `max_retry_delay` seconds. A failure is reported by a
+    `WriteError` raised once from the next `put` or `flush`, and from `close`
+    if some items could not be written at all.
+    """
+    _write_batch: Callable[[List[Tuple[Hashable, Any]]], None]
+    _pending: Dict[Hashable, Any]
+
+    def __init__(self, write_batch: Callable[[List[Tuple[Hashable, Any]]], None],
+                 retry_delay: float = 0.5, max_retry_delay: float = 30.):
+        self._write_batch = write_batch
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self._pending = dict()
+        self._writing = False
+        self._closed = False
+        self._error = None
+        self._error_reported = False
+        self._n_failures = 0
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="piannot-write-behind", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def put(self, key: Hashable, item: Any):
+        self.put_many([(key, item)])
+
+    def put_many(self, items: Iterable[Tuple[Hashable, Any]]):
+        """Queue all `(key, item)` pairs, then raise `WriteError` if a write has failed since the last report."""
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Cannot put items to a closed queue.")
+            self._pending.update(items)
+            self._condition.notify_all()
+            self._raise_unreported_error()
+
+    def _raise_unreported_error(self):
+        if self._error is not None and not self._error_reported:
+            self._error_reported = True
+            raise WriteError(
+                f"Writing failed, {len(self._pending)} items are pending and will be retried: {self._error}"
+            ) from self._error
+
+    def _run(self):
+        retry_at, n_retries = None, 0
+        while True:
+            with self._condition:
+                while not self._closed:
+                    if retry_at is None:
+                        if self._pending:
+                            break
+                        self._condition.wait()
+                    else:
+                        remaining = retry_at - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._condition.wait(remaining)
+                if not self._pending:
+                    return
+                batch, self._pending = list(self._pending.items()), dict()
+                self._writing = True
+
+            try:
+                self._write_batch(batch)
+            except Exception as exc:
+                logger.exception("Writing of %d items failed.", len(batch))
+                retry_at = time.monotonic() + min(self.retry_delay * 2 ** n_retries, self.max_retry_delay)
+                n_retries += 1
+                with self._condition:
+                    for key, item in batch:
+                        self._pending.setdefault(key, item)
+                    self._error, self._error_reported = exc, False
+                    self._n_failures += 1
+                    self._writing = False
+                    self._condition.notify_all()
+                    if self._closed:
+                        return
+            else:
+                retry_at, n_retries = None, 0
+                with self._condition:
+                    if not self._pending:
+                        self._error = None
+                    self._writing = False
+                    self._condition.notify_all()
+
+    def flush(self):
+        """Block until all pending items are written. Raises `WriteError` if a write fails."""
+        with self._condition:
+            self._raise_unreported_error()
+            n_failures = self._n_failures
+            while (self._pending or self._writing) and self._n_failures == n_failures:
+                self._condition.wait()
+            if self._pending:
+                self._error_reported = True
+                raise WriteError(
+                    f"Writing failed, {len(self._pending)} items are pending and will be retried: {self._error}"
+                ) from self._error
+            self._raise_unreported_error()
+
+    def close(self):
+        """Write pending items and stop the background thread. Raises `WriteError` if some items are lost."""
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+        atexit.unregister(self.close)
+        if self._pending:
+            raise WriteError(
+                f"{len(self._pending)} items could not be written: {self._error}"
+            ) from self._error